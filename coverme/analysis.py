@@ -1,11 +1,24 @@
+import collections
 import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
 import pandas as pd
 
+from . import dominance
+from . import ingest
+from . import volatility
+from .metrics import metrics
+from .screening import Screen
+from .sharding import ShardPool
+
 
 # Specific to market
 SHARES_PER_CONTRACT = 100
 FEE_PER_CONTRACT = 0.65  # E*Trade is $0.65/contract as of June 2020
 FEE_PER_SHARE = FEE_PER_CONTRACT / SHARES_PER_CONTRACT
+# 3-month T-bill, continuously compounded. Only a default: runs take the risk_free_rate of their config
+RISK_FREE_RATE = 0.04
 
 # Constants
 DAYS_PER_YEAR = 365
@@ -19,160 +32,407 @@ def harmonic(x, y):
     return 2 * (x * y) / (x + y)
 
 
+def horizon_bounds(time_horizon: datetime.timedelta, min_time: Optional[datetime.timedelta] = None,
+                   today: datetime.date = None) -> Tuple[Optional[datetime.date], datetime.date]:
+    """
+    The window of expiration dates worth looking at. Known before anything is fetched.
+    :param time_horizon: How far out to look
+    :param min_time: Skip anything expiring sooner than this. None for no minimum
+    :param today: Defaults to the actual today
+    :return: The first and last expiration dates to keep (first is None without a minimum)
+    """
+    today = datetime.date.today() if today is None else today
+    first = None if min_time is None else today + min_time
+    return first, today + time_horizon
+
+
+def split_horizons(df: pd.DataFrame, time_horizons: List[datetime.timedelta],
+                   horizon_ends: np.ndarray) -> Dict[datetime.timedelta, pd.DataFrame]:
+    """
+    See Analysis.horizon_views()
+    :param time_horizons: Shortest first
+    :param horizon_ends: The last expiration date of each horizon (datetime64[D])
+    """
+    # Position of the shortest horizon that includes each row. It is in that horizon and every longer one
+    first_horizon = np.searchsorted(horizon_ends, df["expiration_date"].to_numpy().astype('datetime64[D]'),
+                                    side='left')
+    return {time_horizon: df[first_horizon <= position] for position, time_horizon in enumerate(time_horizons)}
+
+
 class Analysis:
-    def __init__(self, quotes: dict, expirations: dict, option_chains: dict):
+    def __init__(self, quotes: dict, expirations: dict, option_chains: dict, today: datetime.date = None,
+                 pool: ShardPool = None, ratio_dtype=np.float64, screen: Screen = None,
+                 risk_free_rate: float = RISK_FREE_RATE):
+        """
+        :param quotes: Quotes by symbol
+        :param expirations: Expirations by symbol
+        :param option_chains: Option chains by symbol, then by expiration
+        :param today: The day the data was fetched. Defaults to the actual today
+        :param pool: Processes to split the dominance rules over, by symbol. None for this process only
+        :param ratio_dtype: dtype of the *_ratio columns of df_apr. np.float32 halves them, at the cost of ties when
+                            sorting on them
+        :param screen: Contracts its pushed down rules reject are dropped as the chains are read. None keeps every
+                       contract
+        :param risk_free_rate: Continuously compounded, for the implied volatility and the odds of assignment
+        """
         self.symbols = list(quotes.keys())
         self.quotes = quotes
         self.expirations = expirations
         self.option_chains = option_chains
         # The calculations should assume "yesterday" to avoid
         # divide by zero errors when it's expiry is truly today.
-        self.today = datetime.date.today() - datetime.timedelta(days=1)
-        # The last day to keep
+        self.today = (datetime.date.today() if today is None else today) - datetime.timedelta(days=1)
+        self.pool = pool
+        self.ratio_dtype = ratio_dtype
+        self.screen = screen
+        self.risk_free_rate = risk_free_rate
+        # The first and last days to keep
+        self._date_first: datetime.date = None
         self._date_horizon: datetime.date = None
+        # The horizons looked at, shortest first, and the last expiration date of each
+        self.time_horizons: List[datetime.timedelta] = []
+        self.horizon_ends = np.empty(0, dtype='datetime64[D]')
+        # Frames built so far. Cleared whenever an input changes
+        self._frames = {}
+        # How many times each frame was actually built (as opposed to served from self._frames)
+        self.build_counts = collections.Counter()
+        # The rows of df_apr and, once needed, which row beats each row (by position within its symbol). Kept across
+        # update() so only the rows of changed symbols are rebuilt
+        self._apr_rows: Optional[pd.DataFrame] = None
+        self._local_dominators: Optional[Dict[str, np.ndarray]] = None
+        # Symbols whose rows are out of date
+        self._stale_symbols = set()
+
+    def set_time_horizon(self, time_horizon: datetime.timedelta, min_time: datetime.timedelta = None):
+        self.set_time_horizons([time_horizon], min_time)
+
+    def set_time_horizons(self, time_horizons: List[datetime.timedelta], min_time: datetime.timedelta = None):
+        """
+        Look at several horizons in one pass: the rows are built once, out to the longest horizon, and
+        horizon_views() tells them apart
+        :param time_horizons: How far out to look, in any order
+        :param min_time: Skip anything expiring sooner than this, in every horizon. None for no minimum
+        """
+        today = self.today + datetime.timedelta(days=1)
+        self.time_horizons = sorted(time_horizons)
+        self.horizon_ends = np.array([horizon_bounds(time_horizon, min_time, today)[1]
+                                       for time_horizon in self.time_horizons], dtype='datetime64[D]')
+        self._date_first, self._date_horizon = horizon_bounds(self.time_horizons[-1], min_time, today)
+        self.invalidate()
+
+    def horizon_views(self, df: pd.DataFrame) -> Dict[datetime.timedelta, pd.DataFrame]:
+        """
+        The rows of df within each horizon. Every dominance rule needs the beating option to expire no later than
+        the beaten one, so the rule columns of df_apr_objective_omit hold within each horizon too
+        :param df: Rows of df_apr (or of a table ranked from it), in any order
+        :return: The rows of df expiring within each of time_horizons, in the same order, shortest horizon first
+        """
+        return split_horizons(df, self.time_horizons, self.horizon_ends)
+
+    def update(self, quotes: dict = None, expirations: dict = None, option_chains: dict = None) -> int:
+        """
+        Replace any of the inputs. Only the symbols whose quote or chains actually changed are recomputed on the
+        next access; the rows of the other symbols are reused
+        :return: The number of chains in option_chains that did not change
+        """
+        changed = set()
+        unchanged_chains = 0
+
+        if quotes is not None:
+            if list(quotes.keys()) != self.symbols:
+                # Symbol codes are positions in self.symbols, so every row is off
+                self.invalidate()
+            changed |= {symbol for symbol, quote in quotes.items() if quote != self.quotes.get(symbol)}
+            self.symbols = list(quotes.keys())
+            self.quotes = quotes
+
+        if expirations is not None:
+            self.expirations = expirations
+
+        if option_chains is not None:
+            for symbol, option_chain in option_chains.items():
+                previous = self.option_chains.get(symbol, {})
+                same = sum(1 for expiration, chain in option_chain.items() if previous.get(expiration) == chain)
+                unchanged_chains += same
+                if same != len(option_chain) or len(previous) != len(option_chain):
+                    changed.add(symbol)
+            changed |= set(self.option_chains) - set(option_chains)
+            self.option_chains = option_chains
+
+        if changed:
+            self._stale_symbols |= changed
+            self._frames.clear()
+        return unchanged_chains
+
+    def invalidate(self):
+        """
+        Drop every built frame
+        """
+        self._frames.clear()
+        self._apr_rows = None
+        self._local_dominators = None
+        self._stale_symbols = set()
+
+    def _frame(self, name: str, build: Callable[[], object]):
+        """
+        Build a frame once and keep it until the next invalidate(). The build is timed (including any frame it builds
+        in turn)
+        """
+        if name not in self._frames:
+            with metrics.timer(f"analysis.{name}"):
+                self._frames[name] = build()
+            self.build_counts[name] += 1
+        return self._frames[name]
 
-    def set_time_horizon(self, time_horizon: datetime.timedelta):
-        self._date_horizon = self.today + time_horizon + datetime.timedelta(days=1)
+    @property
+    def last_prices(self) -> np.ndarray:
+        """
+        Last price of each of self.symbols
+        """
+        return self._frame("last_prices", lambda: ingest.last_prices(self.quotes, self.symbols))
+
+    @property
+    def chain_columns(self) -> Dict[str, np.ndarray]:
+        """
+        The calls within the time horizon that pass the screen, as typed columns. See ingest.chain_columns. Built
+        once; don't modify the result
+        """
+        return self._frame("chain_columns", lambda: self._chain_columns(self.option_chains))
+
+    def _chain_columns(self, option_chains: dict) -> Dict[str, np.ndarray]:
+        return ingest.chain_columns(option_chains, self.symbols, self._date_first, self._date_horizon, self.screen,
+                                    self.last_prices)
 
     @property
     def df_quotes(self) -> pd.DataFrame:
         """
-        Convert the quotes structure to a table
+        Convert the quotes structure to a table. Built once; don't modify the result
         :return: Quotes as a dataframe
         """
-        last_prices = [self.quotes[symbol]['quotes']['quote']['last'] for symbol in self.symbols]
-        return pd.DataFrame({
+        return self._frame("df_quotes", lambda: pd.DataFrame({
             'symbol': self.symbols,
-            'last': last_prices,
-            'today': [self.today for _ in self.symbols]
-        })
+            'last': self.last_prices,
+            'today': np.full(len(self.symbols), np.datetime64(self.today, 'D'))
+        }))
 
     @property
-    def df_options_chain(self):
+    def df_options_chain(self) -> pd.DataFrame:
         """
-        Convert the options chain to a dataframe. Only grab a subset and only grab calls
+        Convert the options chain to a dataframe. Only grab a subset and only grab calls. Built once; don't modify
+        the result
         :return: Options chain as a dataframe
         """
+        return self._frame("df_options_chain", lambda: self._table(self.chain_columns))
 
-        # Only grab certain fields
-        to_grab = ["underlying", "ask", "asksize", "bid", "bidsize", "last", "strike", "expiration_date"]
-        table = {x: [] for x in to_grab}
-        for option_chain in self.option_chains.values():
-            for expiration_chain in option_chain.values():
-                for contract in expiration_chain['options']['option']:
-                    # Only tracking calls
-                    if contract['option_type'] == "put":
-                        continue
-                    for key in to_grab:
-                        if key == "expiration_date":
-                            contract[key] = datetime.date.fromisoformat(contract[key])
-                        table[key].append(contract[key])
-
-        # Convert to a dataframe, then omit anything outside the time horizon
-        df = pd.DataFrame(table)
-        return df if self._date_horizon is None else df[df['expiration_date'] <= self._date_horizon]
+    def _table(self, columns: Dict[str, np.ndarray]) -> pd.DataFrame:
+        return pd.DataFrame({
+            "underlying": pd.Categorical.from_codes(columns["symbol_code"], categories=self.symbols),
+            **{key: columns[key] for key in ["ask", "asksize", "bid", "bidsize", "last", "strike", "expiration_date"]}
+        })
 
     @property
     def df_apr(self) -> pd.DataFrame:
         """
-        A joint table that performs analysis on the options chain based upon the current stock price
+        A joint table that performs analysis on the options chain based upon the current stock price. Built once;
+        don't modify the result
         :return: The joint table
         """
-        df_apr = pd.merge(self.df_options_chain, self.df_quotes, left_on="underlying", right_on="symbol",
-                          suffixes=("_option", "_stock"))
+        return self._frame("df_apr", self._update_apr_rows)
+
+    def _update_apr_rows(self) -> pd.DataFrame:
+        """
+        Build the rows of df_apr, or only rebuild the rows of the symbols that changed since they were built
+        """
+        if self._apr_rows is None:
+            self._apr_rows = self._build_apr(self.chain_columns)
+            if self._local_dominators is not None:
+                self._local_dominators = self._to_local(self._build_dominators(self._apr_rows), self._apr_rows)
+            self._stale_symbols = set()
+            return self._apr_rows
+
+        if not self._stale_symbols:
+            return self._apr_rows
+
+        # Rebuild the stale symbols in one go, then put every symbol's rows back in the order of option_chains
+        stale = self._stale_symbols
+        fresh = self._build_apr(self._chain_columns(
+            {symbol: chains for symbol, chains in self.option_chains.items() if symbol in stale}))
+        keep = ~self._apr_rows["symbol"].isin(stale).to_numpy()
+        rows = pd.concat([self._apr_rows[keep], fresh], ignore_index=True)
+        rank = {symbol: rank for rank, symbol in enumerate(self.option_chains)}
+        symbol_rank = np.array([rank.get(symbol, len(rank)) for symbol in self.symbols])
+        order = np.argsort(symbol_rank[rows["symbol"].cat.codes.to_numpy()], kind='stable')
+        self._apr_rows = rows.iloc[order].reset_index(drop=True)
+        self.build_counts["df_apr_rows_updated"] += len(fresh)
+
+        if self._local_dominators is not None:
+            fresh_dominators = self._to_local(self._build_dominators(fresh), fresh)
+            self._local_dominators = {
+                column: np.concatenate([positions[keep], fresh_dominators[column]])[order]
+                for column, positions in self._local_dominators.items()
+            }
+
+        self._stale_symbols = set()
+        return self._apr_rows
+
+    @staticmethod
+    def _symbol_starts(df_apr: pd.DataFrame) -> np.ndarray:
+        """
+        For each row, the position of the first row of its symbol (each symbol's rows are together)
+        """
+        codes = pd.factorize(df_apr["symbol"])[0]
+        return pd.Series(np.arange(len(df_apr))).groupby(codes).transform('min').to_numpy()
+
+    def _to_local(self, dominators: Dict[str, np.ndarray], df_apr: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """
+        Positions of beating rows relative to the first row of their symbol, which survive rows moving around
+        """
+        starts = self._symbol_starts(df_apr)
+        return {column: np.where(positions >= 0, positions - starts, -1) for column, positions in dominators.items()}
+
+    def _build_apr(self, columns: Dict[str, np.ndarray]) -> pd.DataFrame:
+        # Computed on plain arrays, and only the columns worth keeping go in the table
+        codes = columns["symbol_code"]
+        strike = columns["strike"]
+        bid = columns["bid"]
+        ask = columns["ask"]
+
+        # Join the stock onto each option by looking up its symbol code (no need for a merge)
+        last_stock = self.last_prices[codes]
 
         # Expected premium per share, minus the fee. "Net premium" is the instance proceeds, and minimum proceeds
         # The "bid" is a conservative estimate of what one can expect to trade at at the moment
-        df_apr["net_premium"] = df_apr["bid"] - FEE_PER_SHARE
+        net_premium = bid - FEE_PER_SHARE
 
         # "Max proceeds" is the most one can make, per share, considering the stock exceeds the strike price and the
         # option is exercised. Includes the premium and the fee
-        df_apr["max_proceeds"] = df_apr["strike"] - df_apr["last_stock"] + df_apr["net_premium"]
+        max_proceeds = strike - last_stock + net_premium
 
         # Calculate how much the stock has to go up to hit the strike price
-        df_apr["stock_to_strike_ratio"] = (df_apr["strike"] - df_apr["last_stock"]) / df_apr["last_stock"]
+        stock_to_strike_ratio = (strike - last_stock) / last_stock
 
         # The break-even price. The price at which the stock needs to cost at expiration if the option was written
         # at the current share price to make exactly $0.00
-        df_apr["breakeven_price"] = df_apr["strike"] + df_apr["net_premium"] - FEE_PER_SHARE
+        breakeven_price = strike + net_premium - FEE_PER_SHARE
 
         # Filter out any net premiums do not exceed max proceeds. Likely from an overly low strike price combined with
-        # a low premium.
-        df_apr["net_premium_adj"] = df_apr[['net_premium', 'max_proceeds']].min(axis=1)
+        # a low premium. (fmin, like min(), ignores a missing side)
+        net_premium_adj = np.fmin(net_premium, max_proceeds)
 
         # The number of days one must commit to the option before the expire
-        df_apr["commitment_period"] = df_apr["expiration_date"] - df_apr['today']
+        commitment_period = (columns["expiration_date"] - np.datetime64(self.today, 'D')).astype(np.int32)
 
         # A number that converts from an instantaneous ratio to a APR based upon the commitment
         # (and to percentage units)
-        df_apr["ratio_to_apr"] = DAYS_PER_YEAR / df_apr["commitment_period"].dt.days * TO_PERCENT
+        with np.errstate(divide='ignore'):
+            ratio_to_apr = DAYS_PER_YEAR / commitment_period * TO_PERCENT
 
         # Calculate each of the above as a ratio of the last stock--effectively normalizing high- and low-priced stocks
         # with each other
-        df_apr["net_premium_ratio"] = df_apr["net_premium"] / df_apr["last_stock"]
-        df_apr["max_proceeds_ratio"] = df_apr["max_proceeds"] / df_apr["last_stock"]
-        df_apr["net_premium_adj_ratio"] = df_apr["net_premium_adj"] / df_apr["last_stock"]
+        max_proceeds_ratio = max_proceeds / last_stock
+        net_premium_adj_ratio = net_premium_adj / last_stock
 
         # Harmonic mean of stock-to-strike (how far to ITM) and premium
-        df_apr["harmonic_ratio"] = harmonic(df_apr['net_premium_adj_ratio'], df_apr['stock_to_strike_ratio'])
-
-        # Convert the ratio units to an apr (a proper percentage now)
-        df_apr["net_premium_adj_apr"] = df_apr['net_premium_adj_ratio'] * df_apr["ratio_to_apr"]
-        df_apr["max_proceeds_apr"] = df_apr['max_proceeds_ratio'] * df_apr["ratio_to_apr"]
+        harmonic_ratio = harmonic(net_premium_adj_ratio, stock_to_strike_ratio)
 
-        # Convert to a per-contract value
-        # "How much cash-money is received as premium"
-        df_apr["net_premium_per_contract"] = df_apr["bid"] * SHARES_PER_CONTRACT - FEE_PER_CONTRACT
-        # "How many assets are tied up
-        df_apr["commitment_value_per_contract"] = df_apr["last_stock"] * SHARES_PER_CONTRACT
+        # The risk of being assigned, from the volatility the market prices in. At the mid price: the bid alone
+        # understates it. Without a bid, or deep in the money under a stale quote, there is no telling (NaN)
+        years = commitment_period / DAYS_PER_YEAR
+        with np.errstate(invalid='ignore'):
+            mid = np.where((bid > 0) & (ask >= bid), 0.5 * (bid + ask), np.nan)
+        implied_volatility, _ = volatility.implied_volatility(mid, last_stock, strike, years, self.risk_free_rate)
+        delta, prob_itm = volatility.assignment_risk(last_stock, strike, years, self.risk_free_rate,
+                                                     implied_volatility)
 
-        return df_apr
+        return pd.DataFrame({
+            # Every row names one of self.symbols, so the codes are the categorical's codes as they are
+            "symbol": pd.Categorical.from_codes(codes, categories=self.symbols),
+            "ask": ask,
+            "asksize": columns["asksize"],
+            "bid": bid,
+            "bidsize": columns["bidsize"],
+            "last_option": columns["last"],
+            "strike": strike,
+            "expiration_date": columns["expiration_date"],
+            "last_stock": last_stock,
+            "net_premium": net_premium,
+            "max_proceeds": max_proceeds,
+            "stock_to_strike_ratio": stock_to_strike_ratio.astype(self.ratio_dtype),
+            "breakeven_price": breakeven_price,
+            "commitment_period": commitment_period,
+            "net_premium_adj_ratio": net_premium_adj_ratio.astype(self.ratio_dtype),
+            "harmonic_ratio": harmonic_ratio.astype(self.ratio_dtype),
+            "implied_volatility": implied_volatility.astype(self.ratio_dtype),
+            "delta": delta.astype(self.ratio_dtype),
+            # Probability of expiring in the money (and the stock being called away)
+            "prob_itm": prob_itm.astype(self.ratio_dtype),
+            # Convert the ratio units to an apr (a proper percentage now)
+            "net_premium_adj_apr": net_premium_adj_ratio * ratio_to_apr,
+            "max_proceeds_apr": max_proceeds_ratio * ratio_to_apr,
+            # Convert to a per-contract value
+            # "How much cash-money is received as premium"
+            "net_premium_per_contract": bid * SHARES_PER_CONTRACT - FEE_PER_CONTRACT,
+            # "How many assets are tied up
+            "commitment_value_per_contract": last_stock * SHARES_PER_CONTRACT,
+        })
 
     @property
     def df_apr_objective_omit(self) -> pd.DataFrame:
+        """
+        df_apr, plus rules for good deals that are objectively beaten. Each rule column holds the index of the option
+        that beats the row (or None), and "omit" lists all of them as text ('' when the row is not beaten). Built
+        once; don't modify the result
+        :return: The joint table with the rule columns
+        """
+        return self._frame("df_apr_objective_omit", self._build_df_apr_objective_omit)
+
+    def _build_dominators(self, df_apr: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """
+        The dominance rules over a table. See dominance
+        :return: The position of the beating row per row (-1 if none), by rule
+        """
+        columns = (
+            pd.factorize(df_apr['symbol'])[0],
+            dominance.to_days(df_apr['expiration_date']),
+            df_apr['net_premium_adj_apr'].to_numpy(dtype=float),
+            df_apr['net_premium'].to_numpy(dtype=float),
+            df_apr['strike'].to_numpy(dtype=float),
+        )
+        if self.pool is not None:
+            return self.pool.dominators(*columns)
+        return dominance.dominators(*columns)
 
-        df_output = self.df_apr
-
-        # Add some rules for good deals that are objectively beaten
-        df_output["worse_apr_strike"] = None
-        df_output["worse_premium_expiry"] = None
-        df_output["worse_strike_expiry"] = None
-
-        for rowi, row in df_output.iterrows():
-            # For a fixed expiry date, an option with both a greater APR and and greater strike price is objectively better
-            df_output.loc[
-                (row['expiration_date'] == df_output['expiration_date']) &
-                (row['net_premium_adj_apr'] >= df_output["net_premium_adj_apr"]) &
-                (row['strike'] >= df_output["strike"]) &
-                # Needs to be the same symbol
-                (row['symbol'] == df_output['symbol']) &
-                # Don't check itself
-                (rowi != df_output.index),
-                'worse_apr_strike'] = rowi
-
-            # For a fixed strike price, an option with both a great premium / contract and a sooner expiry date is
-            # objectively better
-            df_output.loc[
-                (row['expiration_date'] <= df_output['expiration_date']) &
-                (row['net_premium'] >= df_output["net_premium"]) &
-                (row['strike'] == df_output["strike"]) &
-                # Needs to be the same symbol
-                (row['symbol'] == df_output['symbol']) &
-                # Don't check itself
-                (rowi != df_output.index),
-                'worse_premium_expiry'] = rowi
-
-            # For a fixed APR (within 1%), an option with a sooner expiry date and a >= strike price is possibly better.
-            # ... In further thought it's more of a judgement call. Longer expiry to take advantage of a higher APR for
-            # longer
-            df_output.loc[
-                (row['expiration_date'] <= df_output['expiration_date']) &
-                ((row['net_premium_adj_apr'] - df_output["net_premium_adj_apr"]).abs() < 1) &
-                (row['strike'] >= df_output["strike"]) &
-                # Needs to be the same symbol
-                (row['symbol'] == df_output['symbol']) &
-                # Don't check itself
-                (rowi != df_output.index),
-                'worse_strike_expiry'] = rowi
-
-        return df_output
\ No newline at end of file
+    @property
+    def dominators(self) -> Dict[str, np.ndarray]:
+        """
+        The position in df_apr of the option that beats each row (-1 if none), by rule. See dominance. Built once;
+        don't modify the result
+        """
+        return self._frame("dominators", self._build_global_dominators)
+
+    def _build_global_dominators(self) -> Dict[str, np.ndarray]:
+        df_apr = self.df_apr
+
+        # Rules never cross symbols, so they are kept relative to each symbol's first row
+        if self._local_dominators is None:
+            self._local_dominators = self._to_local(self._build_dominators(df_apr), df_apr)
+        starts = self._symbol_starts(df_apr)
+        return {column: np.where(positions >= 0, positions + starts, -1)
+                for column, positions in self._local_dominators.items()}
+
+    def _build_df_apr_objective_omit(self) -> pd.DataFrame:
+        df_output = self.df_apr.copy()
+        rules = self.dominators
+
+        for column, positions in rules.items():
+            df_output[column] = dominance.to_labels(positions, df_output.index)
+
+        # Unique beating options per row, in index order
+        beaten_by = np.sort(np.stack(list(rules.values()), axis=1), axis=1)
+        omit = np.full(len(df_output), '', dtype=object)
+        for rowi in np.flatnonzero((beaten_by >= 0).any(axis=1)):
+            positions = np.unique(beaten_by[rowi][beaten_by[rowi] >= 0])
+            omit[rowi] = ', '.join(str(x) for x in df_output.index[positions])
+        df_output['omit'] = omit
+
+        return df_output
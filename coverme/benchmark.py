@@ -0,0 +1,216 @@
+"""
+Offline benchmark of the pipeline on a synthetic universe. Times each stage separately, records peak memory and
+writes the results as JSON so runs can be compared between commits.
+
+    python -m coverme.benchmark --symbols 500 --expirations 8 --strikes 40 --output bench.json
+    python -m coverme.benchmark ... --compare bench.json
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import pathlib
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from . import synthetic
+from .analysis import Analysis
+from .cache import Cache, open_store
+from .sharding import ShardPool
+from .version import __version__
+
+# Stages, in pipeline order
+STAGES = ["cache_load", "df_options_chain", "df_apr", "dominance", "render"]
+# Frames whose size is reported
+FRAMES = ["df_options_chain", "df_apr", "df_apr_objective_omit"]
+
+
+def _write_cache(root: pathlib.Path, backend: str, quotes: dict, expirations: dict, option_chains: dict):
+    """
+    Lay the universe out as the cache of a previous run
+    """
+    store = open_store(root, backend)
+    for symbol in quotes:
+        store.write("quotes", f"{(symbol,)}", json.dumps(quotes[symbol]))
+        store.write("expiration", f"{(symbol,)}", json.dumps(expirations[symbol]))
+        for expiration, chain in option_chains[symbol].items():
+            store.write("optionchains", f"{(symbol, expiration)}", json.dumps(chain))
+    store.close()
+
+
+def _load_cache(src_root: pathlib.Path, dst_root: pathlib.Path, backend: str, symbols: List[str],
+                option_chains: dict):
+    cache = Cache(src_root, dst_root, use_cache=True, backend=backend)
+
+    def missing(*params):
+        raise KeyError(f"{params} is not in the benchmark cache")
+
+    for symbol in symbols:
+        cache.load("quotes", missing, (symbol,))
+        cache.load("expiration", missing, (symbol,))
+        for expiration in option_chains[symbol]:
+            cache.load("optionchains", missing, (symbol, expiration))
+    cache.close()
+
+
+def _stages(universe: tuple, horizon: datetime.timedelta, workdir: pathlib.Path, backend: str,
+            pool: ShardPool = None, ratio_dtype=np.float64) -> Dict[str, Callable[[], Callable[[], object]]]:
+    """
+    Each stage as a setup function (not timed) returning the function to time
+    """
+    # Imported here: main pulls in the config (confuse) and the setup of a run, which the other stages don't need
+    from . import main
+
+    quotes, expirations, option_chains = universe
+    symbols = list(quotes)
+    src_root = workdir / "src"
+    _write_cache(src_root, backend, quotes, expirations, option_chains)
+    runs = iter(range(sys.maxsize))
+
+    def analysis(*frames: str) -> Analysis:
+        """
+        A fresh analysis, with the frames of earlier stages already built
+        """
+        result = Analysis(quotes, expirations, option_chains, pool=pool, ratio_dtype=ratio_dtype)
+        result.set_time_horizon(horizon)
+        for frame in frames:
+            getattr(result, frame)
+        return result
+
+    def cache_load():
+        dst_root = workdir / f"dst{next(runs)}"
+        return lambda: _load_cache(src_root, dst_root, backend, symbols, option_chains)
+
+    def df_options_chain():
+        built = analysis()
+        return lambda: built.df_options_chain
+
+    def df_apr():
+        built = analysis("chain_columns")
+        return lambda: built.df_apr
+
+    def dominance():
+        built = analysis("df_apr")
+        return lambda: built.df_apr_objective_omit
+
+    def render():
+        built = analysis("df_apr_objective_omit")
+
+        def timed():
+            with contextlib.redirect_stdout(io.StringIO()):
+                main.render(main.rank(built, omit_dominated=True), symbols)
+        return timed
+
+    return {"cache_load": cache_load, "df_options_chain": df_options_chain, "df_apr": df_apr,
+            "dominance": dominance, "render": render}
+
+
+def _frame_bytes(universe: tuple, horizon: datetime.timedelta, ratio_dtype) -> Dict[str, int]:
+    """
+    Memory held by each of FRAMES once built, strings included
+    """
+    analysis = Analysis(*universe, ratio_dtype=ratio_dtype)
+    analysis.set_time_horizon(horizon)
+    return {name: int(getattr(analysis, name).memory_usage(deep=True).sum()) for name in FRAMES}
+
+
+def run(symbols: int, expirations: int, strikes: int, repeat: int = 3, backend: str = "files",
+        seed: int = 0, workers: int = 1, float32: bool = False) -> dict:
+    """
+    Benchmark every stage
+    :return: The results, ready to be written as JSON
+    """
+    universe = synthetic.universe(symbols, expirations, strikes, seed)
+    # Look far enough ahead to keep every expiration
+    horizon = datetime.timedelta(weeks=expirations + 1)
+    n_contracts = sum(len(chain["options"]["option"]) for chains in universe[2].values() for chain in chains.values())
+
+    ratio_dtype = np.float32 if float32 else np.float64
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = ShardPool(workers, min_rows=0) if workers > 1 else None
+        stages = _stages(universe, horizon, pathlib.Path(tmp), backend, pool, ratio_dtype)
+        for name in STAGES:
+            # Time without tracing (it slows allocations down), then one more pass to measure memory
+            timings = []
+            for _ in range(repeat):
+                timed = stages[name]()
+                start = time.perf_counter()
+                timed()
+                timings.append(time.perf_counter() - start)
+
+            timed = stages[name]()
+            tracemalloc.start()
+            timed()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            results[name] = {"seconds": min(timings), "mean_seconds": sum(timings) / len(timings),
+                             "peak_bytes": peak}
+        if pool is not None:
+            pool.close()
+
+    return {
+        "version": __version__,
+        "timestamp": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "params": {"symbols": symbols, "expirations": expirations, "strikes": strikes, "repeat": repeat,
+                   "backend": backend, "seed": seed, "workers": workers, "float32": float32,
+                   "contracts": n_contracts},
+        "stages": results,
+        "frame_bytes": _frame_bytes(universe, horizon, ratio_dtype),
+    }
+
+
+def report(results: dict, baseline: dict = None) -> str:
+    """
+    The results as a table, with the change against a baseline when given
+    """
+    lines = [f"{'stage':<18}{'seconds':>10}{'peak MiB':>10}" + (f"{'vs base':>10}" if baseline else "")]
+    for name, stage in results["stages"].items():
+        line = f"{name:<18}{stage['seconds']:>10.4f}{stage['peak_bytes'] / 2 ** 20:>10.1f}"
+        if baseline and name in baseline["stages"]:
+            line += f"{stage['seconds'] / baseline['stages'][name]['seconds']:>9.2f}x"
+        lines.append(line)
+
+    lines.append(f"{'frame':<28}{'MiB':>10}" + (f"{'vs base':>10}" if baseline else ""))
+    for name, size in results.get("frame_bytes", {}).items():
+        line = f"{name:<28}{size / 2 ** 20:>10.1f}"
+        if baseline and name in baseline.get("frame_bytes", {}):
+            line += f"{size / baseline['frame_bytes'][name]:>9.2f}x"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark cover.me on a synthetic universe")
+    parser.add_argument("--symbols", type=int, default=100)
+    parser.add_argument("--expirations", type=int, default=8, help="Expirations per symbol")
+    parser.add_argument("--strikes", type=int, default=40, help="Strikes per expiration")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage (the fastest is kept)")
+    parser.add_argument("--backend", default="files", help="Cache backend")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="Processes for the dominance rules")
+    parser.add_argument("--float32", action="store_true", help="Keep the ratio columns as float32")
+    parser.add_argument("--output", type=pathlib.Path, help="Write the results here as JSON")
+    parser.add_argument("--compare", type=pathlib.Path, help="Results of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    results = run(args.symbols, args.expirations, args.strikes, args.repeat, args.backend, args.seed,
+                  args.workers, args.float32)
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    print(report(results, baseline))
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+
+if "__main__" == __name__:
+    main(sys.argv[1:])
@@ -1,24 +1,454 @@
+import atexit
+import contextlib
 import json
+import os
 import pathlib
+import queue
 import shutil
-from typing import Callable
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from .freshness import FreshnessPolicy
+
+SQLITE_FILENAME = "cache.sqlite"
+# Lock files of a shared cache. Entries are spread over them, so there are never more however many entries there are
+SHARED_LOCK_STRIPES = 256
+
+
+class FileStore:
+    def __init__(self, root: pathlib.Path):
+        """
+        One JSON file per entry: <root>/<name>/<key>.json
+        :param root: The folder of the store
+        """
+        # Absolute, since other stores may refer to it
+        self.root = pathlib.Path(root).absolute()
+
+    def _path(self, name: str, key: str) -> pathlib.Path:
+        return self.root / name / f"{key}.json"
+
+    def exists(self, name: str, key: str) -> bool:
+        return self._path(name, key).is_file()
+
+    def read(self, name: str, key: str) -> str:
+        return self._path(name, key).read_text()
+
+    def keys(self, name: str) -> List[str]:
+        return sorted(path.stem for path in (self.root / name).glob("*.json"))
+
+    def fetched_at(self, name: str, key: str) -> float:
+        """
+        When the entry was fetched from the server (the file keeps its mtime when linked)
+        """
+        return self._path(name, key).stat().st_mtime
+
+    def write(self, name: str, key: str, payload: str, fetched_at: float = None):
+        path = self._path(name, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Replace rather than overwrite: the old file may be a hard link shared with another run
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(payload)
+        if fetched_at is not None:
+            os.utime(str(tmp_path), (fetched_at, fetched_at))
+        os.replace(str(tmp_path), str(path))
+
+    def link(self, name: str, key: str, src):
+        """
+        Make the entry the same as the entry of another store. Hard links when possible, instead of copying
+        """
+        path = self._path(name, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(src, FileStore):
+            src_path = src._path(name, key)
+            if src_path == path:
+                return
+            if path.exists():
+                path.unlink()
+            try:
+                os.link(str(src_path), str(path))
+            except OSError:
+                # Different filesystem, or links are not supported
+                shutil.copy2(str(src_path), str(path))
+        else:
+            self.write(name, key, src.read(name, key), src.fetched_at(name, key))
+
+    def close(self):
+        pass
+
+
+class SqliteStore:
+    def __init__(self, path: pathlib.Path):
+        """
+        Every entry of a run in a single SQLite file. An entry either holds its payload or refers to the store that
+        does, so reusing the previous run's entry doesn't copy it
+        :param path: The SQLite file. Created if needed
+        """
+        # Absolute, since other stores may refer to it
+        self.path = pathlib.Path(path).absolute()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "name TEXT NOT NULL, key TEXT NOT NULL, payload TEXT, ref TEXT, fetched_at REAL NOT NULL, "
+            "PRIMARY KEY (name, key))")
+        # Stores that entries refer to, opened on demand
+        self._refs: Dict[str, object] = {}
+
+    def _row(self, name: str, key: str) -> Optional[tuple]:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT payload, ref, fetched_at FROM entries WHERE name = ? AND key = ?", (name, key)).fetchone()
+
+    def _put(self, name: str, key: str, payload: Optional[str], ref: Optional[str], fetched_at: float):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries (name, key, payload, ref, fetched_at) VALUES (?, ?, ?, ?, ?)",
+                (name, key, payload, ref, fetched_at))
+
+    def _ref_store(self, ref: str):
+        with self._lock:
+            if ref not in self._refs:
+                self._refs[ref] = open_store(pathlib.Path(ref))
+            return self._refs[ref]
+
+    def exists(self, name: str, key: str) -> bool:
+        return self._row(name, key) is not None
+
+    def read(self, name: str, key: str) -> str:
+        row = self._row(name, key)
+        if row is None:
+            raise FileNotFoundError(f"{name} {key} is not in {self.path}")
+        payload, ref, _ = row
+        return payload if ref is None else self._ref_store(ref).read(name, key)
+
+    def keys(self, name: str) -> List[str]:
+        with self._lock:
+            return [key for key, in self._connection.execute(
+                "SELECT key FROM entries WHERE name = ? ORDER BY key", (name,))]
+
+    def fetched_at(self, name: str, key: str) -> float:
+        row = self._row(name, key)
+        if row is None:
+            raise FileNotFoundError(f"{name} {key} is not in {self.path}")
+        return row[2]
+
+    def origin(self, name: str, key: str) -> str:
+        """
+        The location of the store that holds the payload of the entry
+        """
+        _, ref, _ = self._row(name, key)
+        return str(self.path) if ref is None else ref
+
+    def write(self, name: str, key: str, payload: str, fetched_at: float = None):
+        self._put(name, key, payload, None, time.time() if fetched_at is None else fetched_at)
+
+    def link(self, name: str, key: str, src):
+        """
+        Make the entry refer to the entry of another store (always to the store that holds the payload, so
+        references never chain)
+        """
+        self.refer(name, key, src.origin(name, key) if isinstance(src, SqliteStore) else str(src.root),
+                   src.fetched_at(name, key))
+
+    def refer(self, name: str, key: str, ref: str, fetched_at: float):
+        """
+        Make the entry refer to the store at ref, which holds the payload
+        """
+        if ref != str(self.path):
+            self._put(name, key, None, ref, fetched_at)
+
+    def materialize(self, refs: Set[str] = None) -> int:
+        """
+        Copy the payloads of entries that refer to other stores into this store, so those stores can be deleted.
+        Entries referring to stores already gone are dropped
+        :param refs: Only entries referring to these locations. None for every reference
+        :return: The number of entries copied
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT name, key, ref, fetched_at FROM entries WHERE ref IS NOT NULL").fetchall()
+        count = 0
+        for name, key, ref, fetched_at in rows:
+            if refs is not None and ref not in refs:
+                continue
+            if not pathlib.Path(ref).exists():
+                with self._lock:
+                    self._connection.execute("DELETE FROM entries WHERE name = ? AND key = ?", (name, key))
+                continue
+            self._put(name, key, self._ref_store(ref).read(name, key), None, fetched_at)
+            count += 1
+        return count
+
+    def vacuum(self):
+        """
+        Give the space of replaced entries back to the filesystem
+        """
+        with self._lock:
+            self._connection.execute("VACUUM")
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+            for store in self._refs.values():
+                store.close()
+            self._refs.clear()
+
+
+def open_store(root: pathlib.Path, backend: str = None):
+    """
+    Open the store at a location
+    :param root: The cache folder of a run, or a SQLite file
+    :param backend: "files" or "sqlite". None to detect from what is already on disk
+    :return: The store
+    """
+    root = pathlib.Path(root)
+    if root.suffix == ".sqlite":
+        return SqliteStore(root)
+    if backend is None:
+        backend = "sqlite" if (root / SQLITE_FILENAME).is_file() else "files"
+    if backend == "sqlite":
+        return SqliteStore(root / SQLITE_FILENAME)
+    if backend == "files":
+        return FileStore(root)
+    raise ValueError(f"Unknown cache backend: {backend}")
+
+
+class WriteBehind:
+    def __init__(self, max_queued: int):
+        """
+        Runs store writes on a background thread, in order. Once max_queued writes are waiting, adding one waits for
+        the disk to catch up. A failed write is raised by the next put() or by close(), so it can't go unnoticed
+        :param max_queued: Writes waiting at most
+        """
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._error: Optional[BaseException] = None
+        # A daemon, so a crash elsewhere doesn't hang the exit. Flushed at exit instead
+        self._thread = threading.Thread(target=self._run, name="cache-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            func, args = task
+            try:
+                func(*args)
+            except BaseException as ex:
+                # Keep going: the remaining writes may well succeed. The first failure is what gets reported
+                if self._error is None:
+                    self._error = ex
+
+    def _raise(self):
+        if self._error is not None:
+            raise IOError(f"Writing the cache failed: {self._error!r}") from self._error
+
+    def put(self, func: Callable, *args):
+        """
+        Queue func(*args)
+        """
+        self._raise()
+        self._queue.put((func, args))
+
+    def close(self):
+        """
+        Wait for every queued write
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+            atexit.unregister(self.close)
+        self._raise()
+
+
+class SharedCache:
+    def __init__(self, root: pathlib.Path):
+        """
+        Entries shared by every config, for the runs going at the same time to fetch each one once: one waits for an
+        entry another is fetching instead of fetching it too, then reuses it. Laid out like a FileStore. Locked across
+        processes (and threads) with flock, so POSIX only
+        :param root: The folder. Created if needed
+        """
+        self.store = FileStore(root)
+        self._lock_root = self.store.root / "locks"
+        self._lock_root.mkdir(parents=True, exist_ok=True)
+
+    @contextlib.contextmanager
+    def _locked(self, name: str, keys: List[str]):
+        """
+        Hold the locks of the entries. Taken in order, so two holders of overlapping entries can't deadlock
+        """
+        # Imported here: POSIX only, and only needed when a shared cache is configured
+        import fcntl
+
+        stripes = sorted({zlib.crc32(f"{name}/{key}".encode()) % SHARED_LOCK_STRIPES for key in keys})
+        files = []
+        try:
+            for stripe in stripes:
+                # Each open is locked separately, even by threads of the same process. Closing unlocks
+                files.append(open(self._lock_root / f"{stripe}.lock", "a"))
+                fcntl.flock(files[-1], fcntl.LOCK_EX)
+            yield
+        finally:
+            for file in files:
+                file.close()
+
+    def _lookup(self, name: str, key: str, is_fresh: Callable[[float], bool],
+                since: float = None) -> Optional[Tuple[str, float]]:
+        """
+        :return: The payload and fetch time of the entry, if it is fresh or was fetched since then. None otherwise
+        """
+        try:
+            fetched_at = self.store.fetched_at(name, key)
+            if not is_fresh(fetched_at) and (since is None or fetched_at < since):
+                return None
+            # Entries are replaced, never overwritten: this is the entry checked, or one fetched later still
+            return self.store.read(name, key), fetched_at
+        except FileNotFoundError:
+            # Or just pruned
+            return None
+
+    def load(self, name: str, keys: List[str], fetch: Callable[[List[int]], list],
+             is_fresh: Callable[[float], bool]) -> List[Tuple[str, float, bool]]:
+        """
+        Entries from the shared folder when fresh, otherwise fetched and shared. Entries being fetched by someone else
+        are waited for
+        :param name: The name of the service
+        :param keys: The key of each entry
+        :param fetch: Called with the positions of the keys to fetch. Returns one result for each
+        :param is_fresh: Whether an entry fetched at a time (as from time.time()) can be reused
+        :return: The payload and fetch time of each entry, and whether it was fetched here
+        """
+        start = time.time()
+        entries = [self._lookup(name, key, is_fresh) for key in keys]
+        missing = [i for i, entry in enumerate(entries) if entry is None]
+        if not missing:
+            return [(payload, fetched_at, False) for payload, fetched_at in entries]
+
+        fetched = set()
+        with self._locked(name, [keys[i] for i in missing]):
+            # Whatever was fetched while waiting for the locks is as good as fetched here
+            for i in missing:
+                entries[i] = self._lookup(name, keys[i], is_fresh, since=start)
+            missing = [i for i in missing if entries[i] is None]
+            if missing:
+                for i, result in zip(missing, fetch(missing)):
+                    # Written before unlocking, for those waiting
+                    self.store.write(name, keys[i], json.dumps(result))
+                    entries[i] = (self.store.read(name, keys[i]), self.store.fetched_at(name, keys[i]))
+                    fetched.add(i)
+        return [(payload, fetched_at, i in fetched) for i, (payload, fetched_at) in enumerate(entries)]
+
+    def prune(self, max_age: float) -> int:
+        """
+        Delete the entries fetched longer ago than max_age seconds (mostly chains of past expirations)
+        :return: The number of entries deleted
+        """
+        count = 0
+        oldest = time.time() - max_age
+        for path in self.store.root.glob("*/*.json"):
+            with contextlib.suppress(FileNotFoundError):
+                if path.stat().st_mtime < oldest:
+                    path.unlink()
+                    count += 1
+        return count
 
 
 class Cache:
-    def __init__(self, src_root: pathlib.Path, dst_root: pathlib.Path, use_cache=True):
+    def __init__(self, src_root: pathlib.Path, dst_root: pathlib.Path, use_cache=True, backend: str = "files",
+                 freshness: FreshnessPolicy = None, write_behind: bool = False, max_queued: int = 256,
+                 shared: SharedCache = None):
         """
         Mechanism to perform caching to the filesystem. Appropriate when cache is located in logs. Works
         well on conguru.
         :param src_root: The location of the cache
         :param dst_root: The location cache is copied to. (Adequate for being the "next" cache)
-        :param use_cache:
+        :param use_cache: Reuse every entry of src_root, however old
+        :param backend: How dst_root stores entries: "files" (one JSON file each) or "sqlite" (one file in all).
+                        src_root is read in whichever format it was written
+        :param freshness: Without use_cache, entries of src_root this policy considers fresh are still reused
+        :param write_behind: Return what was fetched (or read from src_root) right away, and write dst_root on a
+                             background thread. Otherwise every entry is written, then read back from dst_root
+        :param max_queued: With write_behind, writes waiting at most before loading waits for the disk
+        :param shared: Where to look before fetching what src_root can't provide, and to share what is fetched. Its
+                       entries are reused per use_cache and freshness too. dst_root still gets a copy of each
         """
         self.src_root = src_root
         self.dst_root = dst_root
+        self.src = open_store(src_root)
+        self.dst = open_store(dst_root, backend)
+        # Reused from src_root / found in src_root but too old, so fetched again / not in src_root
         self.hits = 0
+        self.expired = 0
         self.misses = 0
+        # Of the entries not reused from src_root, those another run fetched (or was fetching) in the shared cache
+        self.shared_hits = 0
         self.use_cache = use_cache
+        self.freshness = freshness
+        # Statistics are updated from fetcher threads
+        self._stats_lock = threading.Lock()
+        self._writer = WriteBehind(max_queued) if write_behind else None
+        self.shared = shared
 
+    def _store(self, func: Callable, *args):
+        if self._writer is None:
+            func(*args)
+        else:
+            self._writer.put(func, *args)
+
+    def _write(self, name: str, key: str, result: object):
+        self.dst.write(name, key, json.dumps(result))
+
+    def _reused(self, name: str, key: str) -> object:
+        """
+        Copy the entry of src_root to dst_root. With write_behind, also returns it parsed
+        """
+        self._store(self.dst.link, name, key, self.src)
+        return None if self._writer is None else json.loads(self.src.read(name, key))
+
+    def _reuse(self, name: str, key: str) -> Optional[bool]:
+        """
+        Whether the entry of src_root can be reused
+        :return: True to reuse, False if it's too old, None if it's not there (or not looked for)
+        """
+        if not (self.use_cache or self.freshness is not None) or not self.src.exists(name, key):
+            return None
+        return self.use_cache or self.freshness.is_fresh(name, self.src.fetched_at(name, key))
+
+    def _is_fresh(self, name: str, fetched_at: float) -> bool:
+        return self.use_cache or (self.freshness is not None and self.freshness.is_fresh(name, fetched_at))
+
+    def _shared(self, name: str, keys: List[str], fetch: Callable[[List[int]], list]) -> list:
+        """
+        Load entries through the shared cache, and copy them to dst_root
+        :return: The loaded data. With write_behind it is written later, so don't modify it
+        """
+        results = []
+        entries = self.shared.load(name, keys, fetch, lambda fetched_at: self._is_fresh(name, fetched_at))
+        for key, (payload, fetched_at, fetched) in zip(keys, entries):
+            # As fetched, and as fresh as it was then. Not linked: the shared entry may be replaced by then
+            self._store(self.dst.write, name, key, payload, fetched_at)
+            results.append(json.loads(payload))
+            if not fetched:
+                with self._stats_lock:
+                    self.shared_hits += 1
+        return results
+
+    def _count(self, reuse: Optional[bool]):
+        with self._stats_lock:
+            if reuse:
+                self.hits += 1
+            elif reuse is None:
+                self.misses += 1
+            else:
+                self.expired += 1
 
     def load(self, name: str, miss_callback: Callable, params: tuple) -> object:
         """
@@ -26,27 +456,67 @@ class Cache:
         :param name: The name of the service. Used as part 1/2 of a hash for future cache loads
         :param miss_callback: The callback to call on a cache miss to load directly
         :param params: The parameters to the callback. Used as part 2/2 of a hash for future cache loads.
-        :return: The loaded data
+        :return: The loaded data. With write_behind it is written later, so don't modify it
         """
-        dst_folder = self.dst_root / name
-        dst_folder.mkdir(parents=True, exist_ok=True)
+        key = f"{params}"
 
         # Populate cache, either from the last run (cache hit) or from the servers (cache miss)
-        src_folder = self.src_root / name
-
-        src_filename = src_folder / f"{params}.json"
-        dst_filename = dst_folder / f"{params}.json"
-        if self.use_cache and src_filename.is_file():
+        reuse = self._reuse(name, key)
+        if reuse:
             # Cache hit!
-            shutil.copy(str(src_filename), str(dst_filename))
-            self.hits += 1
+            result = self._reused(name, key)
+        elif self.shared is not None:
+            result, = self._shared(name, [key], lambda _: [miss_callback(*params)])
         else:
-            # Cache miss -- hit the server
+            # Cache miss (or too old) -- hit the server
             result = miss_callback(*params)
-            with dst_filename.open('w') as f:
-                json.dump(result, f)
-            self.misses += 1
+            self._store(self._write, name, key, result)
+        self._count(reuse)
 
+        if self._writer is not None:
+            return result
         # Always load from the now-populated cache to minimize testable code paths
-        with dst_filename.open('r') as f:
-            return json.load(f)
+        return json.loads(self.dst.read(name, key))
+
+    def load_batch(self, name: str, batch_callback: Callable, params_list: List[tuple]) -> list:
+        """
+        Cache.load for many entries of a service that can fetch several entries in one go. All misses are fetched
+        with a single call
+        :param name: The name of the service
+        :param batch_callback: Called with the list of parameters that missed. Returns one result per parameters
+        :param params_list: The parameters of each entry, each one a separate cache entry
+        :return: The loaded data, in the same order as params_list
+        """
+        keys = [f"{params}" for params in params_list]
+        reuses = [self._reuse(name, key) for key in keys]
+
+        results = [self._reused(name, key) if reuse else None for key, reuse in zip(keys, reuses)]
+        missed = [(i, params, key) for i, (params, key, reuse) in enumerate(zip(params_list, keys, reuses))
+                  if not reuse]
+        if missed and self.shared is not None:
+            fetched = self._shared(name, [key for _, _, key in missed],
+                                   lambda positions: batch_callback([missed[j][1] for j in positions]))
+            for (i, _, _), result in zip(missed, fetched):
+                results[i] = result
+        elif missed:
+            fetched = batch_callback([params for _, params, _ in missed])
+            for (i, _, key), result in zip(missed, fetched):
+                self._store(self._write, name, key, result)
+                results[i] = result
+        for reuse in reuses:
+            self._count(reuse)
+
+        if self._writer is not None:
+            return results
+        return [json.loads(self.dst.read(name, key)) for key in keys]
+
+    def close(self):
+        """
+        Finish writing (raising if any write failed) and release the stores
+        """
+        try:
+            if self._writer is not None:
+                self._writer.close()
+        finally:
+            self.src.close()
+            self.dst.close()
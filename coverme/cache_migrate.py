@@ -0,0 +1,75 @@
+"""
+Convert the one-file-per-call cache folders of past runs into one SQLite file per run.
+
+    python -m coverme.cache_migrate [--log-dir logs] [--delete]
+"""
+import argparse
+import pathlib
+import shutil
+import sys
+from typing import Dict, Tuple
+
+import natsort
+from loguru import logger
+
+from . import definitions
+from .cache import SQLITE_FILENAME, FileStore, SqliteStore
+
+
+def migrate_run(cache_folder: pathlib.Path, seen: Dict[Tuple[int, int], str], delete: bool = False) -> int:
+    """
+    Convert the cache folder of one run
+    :param cache_folder: The "cache" folder of the run
+    :param seen: (device, inode) of files already migrated, to the SQLite file holding them. Hard-linked files
+                 become references instead of copies. Updated in place
+    :param delete: Remove the JSON files once converted
+    :return: The number of entries migrated
+    """
+    files = FileStore(cache_folder)
+    store = SqliteStore(cache_folder / SQLITE_FILENAME)
+    count = 0
+    try:
+        for name_folder in sorted(x for x in cache_folder.iterdir() if x.is_dir()):
+            for path in sorted(name_folder.glob("*.json")):
+                stat = path.stat()
+                name, key = name_folder.name, path.stem
+                origin = seen.get((stat.st_dev, stat.st_ino))
+                if origin is not None:
+                    store.refer(name, key, origin, stat.st_mtime)
+                else:
+                    store.write(name, key, files.read(name, key), stat.st_mtime)
+                    seen[(stat.st_dev, stat.st_ino)] = str(store.path)
+                count += 1
+    finally:
+        store.close()
+
+    if delete:
+        for name_folder in [x for x in cache_folder.iterdir() if x.is_dir()]:
+            shutil.rmtree(str(name_folder))
+    return count
+
+
+def migrate(log_dir: pathlib.Path, delete: bool = False):
+    """
+    Convert every run under the log folder, oldest first. Runs already converted are skipped
+    """
+    seen = {}
+    for cache_folder in natsort.natsorted(log_dir.glob("*/*/*/cache")):
+        if (cache_folder / SQLITE_FILENAME).exists():
+            continue
+        count = migrate_run(cache_folder, seen, delete)
+        logger.info("Migrated {} entries in {}", count, cache_folder)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Convert cache folders of past runs to SQLite")
+    parser.add_argument("--log-dir", type=pathlib.Path, default=definitions.LOG_DIR,
+                        help="The root of the logs")
+    parser.add_argument("--delete", action="store_true",
+                        help="Remove the JSON files once converted")
+    args = parser.parse_args(argv)
+    migrate(args.log_dir, args.delete)
+
+
+if "__main__" == __name__:
+    main(sys.argv[1:])
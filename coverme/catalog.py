@@ -0,0 +1,296 @@
+"""
+A catalog of the runs logged under one config name, and the retention policy that prunes them.
+
+    python -m coverme.catalog <name> [--log-dir logs] [--prune]
+"""
+import argparse
+import contextlib
+import datetime
+import fcntl
+import json
+import os
+import pathlib
+import shutil
+import sys
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+import natsort
+from loguru import logger
+
+from . import definitions
+from .cache import SQLITE_FILENAME, SqliteStore
+from .cache_migrate import migrate_run
+
+CATALOG_FILENAME = "catalog.json"
+# Next to the catalog, for the processes updating it to take turns
+CATALOG_LOCK_FILENAME = "catalog.json.lock"
+
+# Runs still marked as running are left alone for this long, in case another process is still writing them
+RUNNING_GRACE = datetime.timedelta(days=1)
+
+
+def parse_friendly_time(friendly_time: str) -> Optional[datetime.datetime]:
+    """
+    The start time of a run, from the name of its folder (see LogFolder.set_path)
+    """
+    for fmt in ("%Y-%m-%d_%H-%M-%S.%f", "%Y-%m-%d_%H-%M-%S"):
+        try:
+            return datetime.datetime.strptime(friendly_time, fmt)
+        except ValueError:
+            pass
+    return None
+
+
+def cache_bytes(folder: pathlib.Path) -> int:
+    """
+    Size of the cache of a run. Files hard-linked between runs count in each of them
+    """
+    cache_folder = folder / "cache"
+    if not cache_folder.is_dir():
+        return 0
+    return sum(path.stat().st_size for path in cache_folder.rglob("*") if path.is_file())
+
+
+class RetentionPolicy:
+    def __init__(self, keep_runs: int, keep_days: float, daily_snapshots: bool = True):
+        """
+        :param keep_runs: The most recent runs are kept whole
+        :param keep_days: So is every run started within this many days
+        :param daily_snapshots: Beyond that, keep the last run of each day with its cache compacted. False deletes
+                                everything beyond that
+        """
+        self.keep_runs = keep_runs
+        self.keep_days = keep_days
+        self.daily_snapshots = daily_snapshots
+
+    def classify(self, runs: List[dict], protect: Iterable[str], now: datetime.datetime = None) \
+            -> Tuple[List[dict], List[dict], List[dict]]:
+        """
+        Decide what becomes of each run
+        :param runs: Catalog records, oldest first
+        :param protect: Paths (as in the records) kept no matter what
+        :param now: For testing
+        :return: The runs kept whole, kept as snapshots and deleted
+        """
+        now = datetime.datetime.now() if now is None else now
+        keep = set(protect)
+        if self.keep_runs > 0:
+            keep.update(run["path"] for run in runs[-self.keep_runs:])
+        cutoff = now - datetime.timedelta(days=self.keep_days)
+
+        # The last run of each day (later runs overwrite earlier ones)
+        last_of_day = {}
+        for run in runs:
+            last_of_day[run["start_time"][:10]] = run["path"]
+        snapshot_paths = set(last_of_day.values()) if self.daily_snapshots else set()
+
+        kept, snapshots, deleted = [], [], []
+        for run in runs:
+            start_time = datetime.datetime.fromisoformat(run["start_time"])
+            if run["path"] in keep or start_time >= cutoff or \
+                    (run["status"] == "running" and now - start_time < RUNNING_GRACE):
+                kept.append(run)
+            elif run["path"] in snapshot_paths:
+                snapshots.append(run)
+            else:
+                deleted.append(run)
+        return kept, snapshots, deleted
+
+
+class Catalog:
+    def __init__(self, root: pathlib.Path):
+        """
+        The runs of one config name: path, start time, status and cache size of each, plus the latest run. Kept in
+        a single JSON file next to the date folders, so finding the latest run doesn't scan them. Updates are locked
+        across processes (and threads) with flock, so POSIX only
+        :param root: The log folder of the config name (<log dir>/<name>)
+        """
+        self.root = pathlib.Path(root)
+        self.path = self.root / CATALOG_FILENAME
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """
+        Hold the catalog for a read-modify-write: concurrent runs of a config each add and finish their own
+        """
+        with self._lock:
+            # Closing unlocks
+            with open(self.root / CATALOG_LOCK_FILENAME, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"latest": None, "runs": []}
+
+    def _write(self, catalog: dict):
+        # Replace, so a reader never sees half a file
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(catalog, f, indent=2)
+        os.replace(str(tmp_path), str(self.path))
+
+    def _relative(self, folder: pathlib.Path) -> str:
+        return pathlib.Path(folder).relative_to(self.root).as_posix()
+
+    def latest(self) -> Optional[pathlib.Path]:
+        """
+        The folder of the latest run, None if the catalog doesn't know any
+        """
+        latest = self._read()["latest"]
+        return None if latest is None else self.root / latest
+
+    def runs(self) -> List[dict]:
+        """
+        Every run, oldest first
+        """
+        return self._read()["runs"]
+
+    def add(self, folder: pathlib.Path, start_time: datetime.datetime):
+        """
+        Record a run that just started, which becomes the latest
+        """
+        with self._locked():
+            catalog = self._read()
+            path = self._relative(folder)
+            catalog["runs"].append({"path": path, "start_time": start_time.isoformat(), "status": "running",
+                                    "cache_bytes": 0})
+            catalog["latest"] = path
+            self._write(catalog)
+
+    def finish(self, folder: pathlib.Path, status: str):
+        """
+        Record how a run ended, and the size of its cache
+        :param status: "ok", "failed" or "interrupted"
+        """
+        with self._locked():
+            catalog = self._read()
+            path = self._relative(folder)
+            for run in catalog["runs"]:
+                if run["path"] == path:
+                    run["status"] = status
+                    run["cache_bytes"] = cache_bytes(folder)
+            self._write(catalog)
+
+    def reconcile(self):
+        """
+        Bring the catalog in line with the folders on disk: runs it doesn't know (older versions, or another process
+        racing on the catalog) are added, runs deleted by hand are dropped
+        """
+        with self._locked():
+            catalog = self._read()
+            on_disk = [folder
+                       for date_folder in natsort.natsorted(x for x in self.root.iterdir() if x.is_dir())
+                       for folder in natsort.natsorted(x for x in date_folder.iterdir() if x.is_dir())]
+            known = {run["path"] for run in catalog["runs"]}
+            runs = [run for run in catalog["runs"] if (self.root / run["path"]).is_dir()]
+            for folder in on_disk:
+                if self._relative(folder) in known:
+                    continue
+                start_time = parse_friendly_time(folder.name) or \
+                    datetime.datetime.fromtimestamp(folder.stat().st_mtime)
+                runs.append({"path": self._relative(folder), "start_time": start_time.isoformat(),
+                             "status": "unknown", "cache_bytes": cache_bytes(folder)})
+            runs.sort(key=lambda run: run["start_time"])
+            catalog["runs"] = runs
+            if catalog["latest"] is None or not (self.root / catalog["latest"]).is_dir():
+                catalog["latest"] = runs[-1]["path"] if runs else None
+            self._write(catalog)
+
+    def prune(self, policy: RetentionPolicy, protect: Iterable[pathlib.Path] = ()) -> dict:
+        """
+        Apply the retention policy. Snapshots get their cache compacted into a single SQLite file holding every
+        payload. Before anything is deleted, SQLite entries referring to it are given their own copy of the payload
+        :param policy: What to keep
+        :param protect: Run folders kept no matter what (e.g. the current run and the one it reads from)
+        :return: Counts of runs kept, compacted and deleted, and the cache bytes freed
+        """
+        self.reconcile()
+        runs = self.runs()
+        kept, snapshots, deleted = policy.classify(runs, [self._relative(folder) for folder in protect])
+        size_before = sum(run["cache_bytes"] for run in snapshots + deleted)
+
+        # Compact the snapshots first, so they no longer refer to anything
+        compacted = 0
+        for run in snapshots:
+            if run.get("compacted"):
+                continue
+            folder = self.root / run["path"]
+            cache_folder = folder / "cache"
+            if (cache_folder / SQLITE_FILENAME).is_file():
+                store = SqliteStore(cache_folder / SQLITE_FILENAME)
+                try:
+                    store.materialize()
+                    store.vacuum()
+                finally:
+                    store.close()
+            elif cache_folder.is_dir():
+                migrate_run(cache_folder, {}, delete=True)
+            run["compacted"] = True
+            run["cache_bytes"] = cache_bytes(folder)
+            compacted += 1
+
+        # Nothing kept may refer to what is deleted (hard-linked files need nothing: the data stays with the link)
+        doomed = set()
+        for run in deleted:
+            cache_folder = (self.root / run["path"] / "cache").absolute()
+            doomed.update([str(cache_folder), str(cache_folder / SQLITE_FILENAME)])
+        if doomed:
+            for run in kept + snapshots:
+                sqlite_path = self.root / run["path"] / "cache" / SQLITE_FILENAME
+                if sqlite_path.is_file():
+                    store = SqliteStore(sqlite_path)
+                    try:
+                        store.materialize(doomed)
+                    finally:
+                        store.close()
+
+        for run in deleted:
+            folder = self.root / run["path"]
+            shutil.rmtree(str(folder))
+            if not any(folder.parent.iterdir()):
+                folder.parent.rmdir()
+
+        # Merge into the catalog as it is now: runs may have been added or finished meanwhile
+        with self._locked():
+            catalog = self._read()
+            deleted_paths = {run["path"] for run in deleted}
+            snapshot_runs = {run["path"]: run for run in snapshots}
+            catalog["runs"] = [snapshot_runs.get(run["path"], run)
+                               for run in catalog["runs"] if run["path"] not in deleted_paths]
+            self._write(catalog)
+
+        return {"kept": len(kept), "snapshots": len(snapshots), "compacted": compacted, "deleted": len(deleted),
+                "bytes_freed": size_before - sum(run["cache_bytes"] for run in snapshots)}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="List the runs of a config, or prune them")
+    parser.add_argument("name", help="The config name (the folder under the log dir)")
+    parser.add_argument("--log-dir", type=pathlib.Path, default=definitions.LOG_DIR,
+                        help="The root of the logs")
+    parser.add_argument("--prune", action="store_true",
+                        help="Apply the retention policy of the config defaults")
+    args = parser.parse_args(argv)
+
+    catalog = Catalog(args.log_dir / args.name)
+    catalog.reconcile()
+    if args.prune:
+        from .config import coverme_config
+        retention_config = coverme_config['retention']
+        policy = RetentionPolicy(keep_runs=retention_config['keep_runs'].get(int),
+                                 keep_days=retention_config['keep_days'].as_number(),
+                                 daily_snapshots=retention_config['daily_snapshots'].get(bool))
+        logger.info("Pruned: {}", catalog.prune(policy, [catalog.latest()]))
+
+    for run in catalog.runs():
+        print(f"{run['start_time']}  {run['status']:<11}  {run['cache_bytes']:>12}  {run['path']}")
+
+
+if "__main__" == __name__:
+    main(sys.argv[1:])
@@ -0,0 +1,182 @@
+"""
+Pareto-dominance rules that mark options as objectively beaten by another option on the same symbol.
+
+Each rule returns, for every row, the position of the row that beats it (-1 when nothing does). When several rows
+beat it, the greatest position is reported.
+"""
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+# Upper bound on the number of cells in one comparison matrix
+_MAX_CELLS = 1 << 22
+# Targets swept together. Small enough that their key window stays narrow
+_TARGET_CHUNK = 128
+# Groups up to this size are compared all at once instead of one at a time
+_SMALL_GROUP = 64
+
+# Two APRs within this many percentage points are considered equal
+APR_TOLERANCE = 1
+
+
+def _group_ids(*keys) -> np.ndarray:
+    """
+    Dense integer id for each distinct combination of keys
+    """
+    return pd.MultiIndex.from_arrays(keys).factorize()[0] if len(keys) > 1 else pd.factorize(keys[0])[0]
+
+
+def _skyline_dominated(group: np.ndarray, better: np.ndarray, value: np.ndarray) -> np.ndarray:
+    """
+    Sort-and-sweep skyline. A row is dominated when another row of its group has both better >= and value >=.
+    :param group: Group id per row
+    :param better: First criterion, larger is better
+    :param value: Second criterion, larger is better
+    :return: Mask of the dominated rows
+    """
+    # Within a group, order by the first criterion then the second, both descending. Every earlier row then beats
+    # or ties the current one on the first criterion, so the row is dominated when the running max of the second
+    # criterion over the earlier rows reaches it
+    order = np.lexsort((-value, -better, group))
+    s_group = group[order]
+    s_better = better[order]
+    s_value = value[order]
+    # NaN never dominates (nor is dominated), so it must not interrupt the running max
+    sweep = pd.Series(np.where(np.isnan(s_value), -np.inf, s_value))
+    prior_max = sweep.groupby(s_group).cummax().groupby(s_group).shift(1).to_numpy()
+    dominated = prior_max >= s_value
+
+    # Exact ties sort next to each other and dominate each other
+    same = (s_group[1:] == s_group[:-1]) & (s_better[1:] == s_better[:-1]) & (s_value[1:] == s_value[:-1])
+    dominated[:-1] |= same
+
+    result = np.zeros(len(order), dtype=bool)
+    result[order] = dominated
+    return result
+
+
+def _last_dominator(group: np.ndarray, targets: np.ndarray, dominates, key: np.ndarray,
+                    below: float, above: float) -> np.ndarray:
+    """
+    For each target row, the greatest position of another row in its group that dominates it
+    :param group: Group id per row
+    :param targets: Mask of the rows worth checking. Others are reported as not dominated
+    :param dominates: Callable (candidate positions, target positions) -> mask, broadcasting the two
+    :param key: A column the rule bounds. Rows with a NaN key can't dominate or be dominated
+    :param below: A candidate's key is never lower than the target's key minus this
+    :param above: A candidate's key is never higher than the target's key plus this
+    :return: Position of the dominating row per row, -1 if none
+    """
+    result = np.full(len(group), -1, dtype=np.int64)
+    targets = targets & ~np.isnan(key)
+
+    # Sort by group, then key (NaN last)
+    order = np.lexsort((key, group))
+    s_group = group[order]
+    starts = np.flatnonzero(np.r_[True, s_group[1:] != s_group[:-1]])
+    sizes = np.diff(np.r_[starts, len(order)])
+    n_targets = np.add.reduceat(targets[order].astype(np.int64), starts)
+    wanted = (sizes > 1) & (n_targets > 0)
+
+    # Small groups: compare every pair at once. Pairs are laid out target by target
+    small = wanted & (sizes <= _SMALL_GROUP)
+    target_pos = order[targets[order] & np.repeat(small, sizes)]
+    if len(target_pos):
+        group_of = np.repeat(np.arange(len(starts)), sizes)
+        sorted_at = np.empty(len(order), dtype=np.int64)
+        sorted_at[order] = np.arange(len(order))
+        target_group = group_of[sorted_at[target_pos]]
+        counts = sizes[target_group]
+        offsets = np.r_[0, np.cumsum(counts)[:-1]]
+        within = np.arange(counts.sum()) - np.repeat(offsets, counts)
+        candidate = order[np.repeat(starts[target_group], counts) + within]
+        target = np.repeat(target_pos, counts)
+        found = np.where(dominates(candidate, target) & (candidate != target), candidate, -1)
+        result[target_pos] = np.maximum.reduceat(found, offsets)
+
+    # Large groups: sweep the targets in key order, comparing each chunk only with the candidates in its key window
+    for start, size in zip(starts[wanted & ~small], sizes[wanted & ~small]):
+        members = order[start:start + size]
+        keys = key[members]
+        checked = members[targets[members]]
+        chunk = max(1, min(_TARGET_CHUNK, _MAX_CELLS // size))
+        for first in range(0, len(checked), chunk):
+            target = checked[first:first + chunk]
+            lo = np.searchsorted(keys, key[target[0]] - below, side='left')
+            hi = np.searchsorted(keys, key[target[-1]] + above, side='right')
+            candidate = members[lo:hi, None]
+            mask = dominates(candidate, target[None, :]) & (candidate != target[None, :])
+            result[target] = np.where(mask, candidate, -1).max(axis=0, initial=-1)
+
+    return result
+
+
+def worse_apr_strike(symbol: np.ndarray, expiration: np.ndarray, apr: np.ndarray,
+                     strike: np.ndarray) -> np.ndarray:
+    """
+    For a fixed expiry date, an option with both a greater APR and and greater strike price is objectively better
+    """
+    group = _group_ids(symbol, expiration)
+    dominated = _skyline_dominated(group, strike, apr)
+    return _last_dominator(group, dominated,
+                           lambda r, t: (apr[r] >= apr[t]) & (strike[r] >= strike[t]),
+                           key=apr, below=0, above=np.inf)
+
+
+def worse_premium_expiry(symbol: np.ndarray, expiration: np.ndarray, premium: np.ndarray,
+                         strike: np.ndarray) -> np.ndarray:
+    """
+    For a fixed strike price, an option with both a great premium / contract and a sooner expiry date is
+    objectively better
+    """
+    group = _group_ids(symbol, strike)
+    dominated = _skyline_dominated(group, -expiration, premium)
+    return _last_dominator(group, dominated,
+                           lambda r, t: (expiration[r] <= expiration[t]) & (premium[r] >= premium[t]),
+                           key=premium, below=0, above=np.inf)
+
+
+def worse_strike_expiry(symbol: np.ndarray, expiration: np.ndarray, apr: np.ndarray,
+                        strike: np.ndarray) -> np.ndarray:
+    """
+    For a fixed APR (within 1%), an option with a sooner expiry date and a >= strike price is possibly better.
+    ... In further thought it's more of a judgement call. Longer expiry to take advantage of a higher APR for longer
+    """
+    # Not a strict dominance, so there is no skyline to prune with. The APR window still bounds the candidates
+    group = _group_ids(symbol)
+    return _last_dominator(group, np.ones(len(group), dtype=bool),
+                           lambda r, t: ((expiration[r] <= expiration[t]) &
+                                         (np.abs(apr[r] - apr[t]) < APR_TOLERANCE) &
+                                         (strike[r] >= strike[t])),
+                           key=apr, below=APR_TOLERANCE, above=APR_TOLERANCE)
+
+
+def dominators(symbol: np.ndarray, expiration: np.ndarray, apr: np.ndarray, premium: np.ndarray,
+               strike: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Every rule over the same rows
+    :return: The position of the beating row per row (-1 if none), by rule
+    """
+    return {
+        "worse_apr_strike": worse_apr_strike(symbol, expiration, apr, strike),
+        "worse_premium_expiry": worse_premium_expiry(symbol, expiration, premium, strike),
+        "worse_strike_expiry": worse_strike_expiry(symbol, expiration, apr, strike),
+    }
+
+
+def to_days(dates: pd.Series) -> np.ndarray:
+    """
+    Dates (date objects or datetime64) as integer days, which compare and sort quickly
+    """
+    return pd.to_datetime(dates).to_numpy().astype('datetime64[D]').astype(np.int64)
+
+
+def to_labels(positions: np.ndarray, index: pd.Index) -> np.ndarray:
+    """
+    Convert positions from the rules into index labels, with None where nothing dominates
+    """
+    labels = np.full(len(positions), None, dtype=object)
+    found = positions >= 0
+    labels[found] = index[positions[found]]
+    return labels
@@ -0,0 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+from .cache import Cache
+
+
+class Fetcher:
+    def __init__(self, cache: Cache, max_workers: int = 1):
+        """
+        Loads many entries through the cache at once, overlapping the network waits of the misses.
+        :param cache: The cache every load goes through (so hit/miss statistics and layout are unchanged)
+        :param max_workers: The number of loads in flight. 1 loads serially, without any threads
+        """
+        self.cache = cache
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+
+    def load_all(self, name: str, miss_callback: Callable, params_list: List[tuple]) -> list:
+        """
+        Cache.load for each of the parameters
+        :param name: The name of the service
+        :param miss_callback: The callback to call on a cache miss to load directly
+        :param params_list: The parameters of each load
+        :return: The loaded data, in the same order as params_list. Raises the first failure
+        """
+        def load(params):
+            return self.cache.load(name, miss_callback, params)
+
+        if self._executor is None:
+            return [load(params) for params in params_list]
+        return list(self._executor.map(load, params_list))
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
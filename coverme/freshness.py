@@ -0,0 +1,117 @@
+"""
+When a cached entry is still good enough to reuse instead of fetching it again
+"""
+import datetime
+import functools
+import time
+from typing import Dict, FrozenSet
+
+from dateutil import tz
+
+MARKET_TZ = tz.gettz("America/New_York")
+MARKET_OPEN = datetime.time(9, 30)
+MARKET_CLOSE = datetime.time(16, 0)
+
+
+def _easter(year: int) -> datetime.date:
+    """
+    Easter Sunday (anonymous Gregorian algorithm)
+    """
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    el = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * el) // 451
+    month, day = divmod(h + el - 7 * m + 114, 31)
+    return datetime.date(year, month, day + 1)
+
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> datetime.date:
+    """
+    The nth (1-based, or -1 for last) weekday (Monday is 0) of a month
+    """
+    if n > 0:
+        first = datetime.date(year, month, 1)
+        return first + datetime.timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+    last = datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days=1)
+    return last - datetime.timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def _observed(day: datetime.date) -> datetime.date:
+    """
+    Holidays on a Saturday are observed on Friday, on a Sunday on Monday
+    """
+    if day.weekday() == 5:
+        return day - datetime.timedelta(days=1)
+    if day.weekday() == 6:
+        return day + datetime.timedelta(days=1)
+    return day
+
+
+@functools.lru_cache(maxsize=None)
+def nyse_holidays(year: int) -> FrozenSet[datetime.date]:
+    """
+    Full-day NYSE closures of a year (early closes are treated as full days)
+    """
+    holidays = {
+        _nth_weekday(year, 1, 0, 3),  # Martin Luther King Jr. Day
+        _nth_weekday(year, 2, 0, 3),  # Washington's Birthday
+        _easter(year) - datetime.timedelta(days=2),  # Good Friday
+        _nth_weekday(year, 5, 0, -1),  # Memorial Day
+        _observed(datetime.date(year, 7, 4)),  # Independence Day
+        _nth_weekday(year, 9, 0, 1),  # Labor Day
+        _nth_weekday(year, 11, 3, 4),  # Thanksgiving
+        _observed(datetime.date(year, 12, 25)),  # Christmas
+    }
+    # New Year's Day on a Saturday is not observed (the Friday belongs to the previous year)
+    new_year = datetime.date(year, 1, 1)
+    if new_year.weekday() != 5:
+        holidays.add(_observed(new_year))
+    if year >= 2022:
+        holidays.add(_observed(datetime.date(year, 6, 19)))  # Juneteenth
+    return frozenset(holidays)
+
+
+class MarketCalendar:
+    """
+    Regular trading hours of US equity and option markets
+    """
+
+    def is_trading_day(self, day: datetime.date) -> bool:
+        return day.weekday() < 5 and day not in nyse_holidays(day.year)
+
+    def is_open(self, timestamp: float) -> bool:
+        now = datetime.datetime.fromtimestamp(timestamp, MARKET_TZ)
+        return self.is_trading_day(now.date()) and MARKET_OPEN <= now.time() < MARKET_CLOSE
+
+    def next_open(self, timestamp: float) -> float:
+        """
+        :return: The first open strictly after the timestamp
+        """
+        now = datetime.datetime.fromtimestamp(timestamp, MARKET_TZ)
+        day = now.date() if now.time() < MARKET_OPEN else now.date() + datetime.timedelta(days=1)
+        while not self.is_trading_day(day):
+            day += datetime.timedelta(days=1)
+        return datetime.datetime.combine(day, MARKET_OPEN, MARKET_TZ).timestamp()
+
+
+class FreshnessPolicy:
+    def __init__(self, ttls: Dict[str, float], calendar: MarketCalendar = None):
+        """
+        :param ttls: Seconds an entry stays fresh, by cache name. Names not listed are never fresh
+        :param calendar: When given, anything fetched while the market is closed stays fresh until the next open
+        """
+        self.ttls = ttls
+        self.calendar = calendar
+
+    def is_fresh(self, name: str, fetched_at: float, now: float = None) -> bool:
+        now = time.time() if now is None else now
+        if now - fetched_at < self.ttls.get(name, 0):
+            return True
+        if self.calendar is not None and not self.calendar.is_open(fetched_at):
+            return now < self.calendar.next_open(fetched_at)
+        return False
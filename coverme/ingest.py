@@ -0,0 +1,94 @@
+"""
+Turn cached Tradier responses into typed column arrays, skipping the intermediate lists of Python objects
+"""
+import datetime
+from typing import Dict, List
+
+import numpy as np
+
+from .screening import Screen
+
+# Fields grabbed from each contract, and their types
+PRICE_FIELDS = ["ask", "bid", "last", "strike"]
+SIZE_FIELDS = ["asksize", "bidsize"]
+
+
+def _contracts(chain: dict) -> List[dict]:
+    """
+    The contracts of an option_chain response. Tradier sends null for none and a bare object for exactly one
+    """
+    contracts = (chain.get('options') or {}).get('option') or []
+    return [contracts] if isinstance(contracts, dict) else contracts
+
+
+def last_prices(quotes: dict, symbols: List[str]) -> np.ndarray:
+    """
+    :param quotes: Parsed quote responses by symbol
+    :param symbols: The order of the result
+    :return: The last price of each symbol
+    """
+    return np.array([quotes[symbol]['quotes']['quote']['last'] for symbol in symbols], dtype=np.float64)
+
+
+def chain_columns(option_chains: dict, symbols: List[str], first: datetime.date = None,
+                  last: datetime.date = None, screen: Screen = None,
+                  stock_prices: np.ndarray = None) -> Dict[str, np.ndarray]:
+    """
+    Calls from every chain as columns. Puts, contracts outside [first, last] and contracts on an underlying that
+    isn't in symbols are dropped.
+    :param option_chains: Parsed option_chain responses by symbol, then by expiration
+    :param symbols: Symbols with a quote. "symbol_code" indexes into this
+    :param first: First expiration date to keep (None for no limit)
+    :param last: Last expiration date to keep (None for no limit)
+    :param screen: Also drop what its pushed down rules reject. None to keep everything
+    :param stock_prices: Last price of each of symbols. Needed with screen
+    :return: "symbol_code" (int32), PRICE_FIELDS (float64, NaN when missing), SIZE_FIELDS (int32) and
+             "expiration_date" (datetime64[D])
+    """
+    code_of = {symbol: code for code, symbol in enumerate(symbols)}
+    first = None if first is None else np.datetime64(first, 'D')
+    last = None if last is None else np.datetime64(last, 'D')
+
+    parts = []
+    for option_chain in option_chains.values():
+        for expiration_chain in option_chain.values():
+            contracts = _contracts(expiration_chain)
+            if not contracts:
+                continue
+
+            part = {"expiration_date": np.array([c['expiration_date'] for c in contracts], dtype='datetime64[D]')}
+
+            # Only tracking calls, within the horizon and with a quote on the underlying
+            keep = np.array([c['option_type'] for c in contracts]) != "put"
+            if first is not None:
+                keep &= part["expiration_date"] >= first
+            if last is not None:
+                keep &= part["expiration_date"] <= last
+            underlying, inverse = np.unique([c['underlying'] for c in contracts], return_inverse=True)
+            part["symbol_code"] = np.array([code_of.get(x, -1) for x in underlying], dtype=np.int32)[inverse]
+            keep &= part["symbol_code"] >= 0
+            if not keep.any():
+                continue
+
+            for key in PRICE_FIELDS:
+                part[key] = np.array([c[key] for c in contracts], dtype=np.float64)
+            for key in SIZE_FIELDS:
+                part[key] = np.array([c[key] or 0 for c in contracts], dtype=np.int32)
+            if screen is not None:
+                # Codes of dropped underlyings are -1: any price will do, they are out already
+                keep = screen.pushdown(keep, part["strike"], stock_prices[np.maximum(part["symbol_code"], 0)])
+            parts.append({key: values[keep] for key, values in part.items()})
+
+    return concat_columns(parts)
+
+
+def concat_columns(parts: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """
+    Stack the columns of several chains (as from chain_columns) into one set
+    """
+    columns = {"symbol_code": np.int32, "expiration_date": 'datetime64[D]'}
+    columns.update({key: np.float64 for key in PRICE_FIELDS})
+    columns.update({key: np.int32 for key in SIZE_FIELDS})
+    if not parts:
+        return {key: np.empty(0, dtype=dtype) for key, dtype in columns.items()}
+    return {key: np.concatenate([part[key] for part in parts]) for key in columns}
@@ -3,6 +3,8 @@ import datetime
 import natsort
 from typing import List, Optional
 
+from .catalog import Catalog
+
 
 class LogFolder:
     folder = pathlib.Path.cwd()
@@ -11,6 +13,7 @@ class LogFolder:
     start_time = datetime.datetime.now()
     latest_log_folder: pathlib.Path = None
     latest_log_folder_checked = False
+    catalog: Catalog = None
 
     @classmethod
     def set_path(cls, root: pathlib.Path, friendly_name: str):
@@ -23,9 +26,23 @@ class LogFolder:
         # Create the folders
         cls.folder.mkdir(parents=True, exist_ok=True)
 
+        # Record the run, which is the latest from now on
+        cls.catalog = Catalog(pathlib.Path(root) / cls.friendly_name)
+        cls.catalog.add(cls.folder, cls.start_time)
+
+    @classmethod
+    def finish(cls, status: str):
+        """
+        Record in the catalog how the run ended
+        :param status: "ok", "failed" or "interrupted"
+        """
+        if cls.catalog is not None:
+            cls.catalog.finish(cls.folder, status)
+
     @classmethod
-    def _get_date_folders(cls, log_folder: pathlib.Path) -> List[str]:
-        return natsort.natsorted(list(log_folder.iterdir()))
+    def _get_date_folders(cls, log_folder: pathlib.Path) -> List[pathlib.Path]:
+        # Folders only: the catalog sits next to them
+        return natsort.natsorted(x for x in log_folder.iterdir() if x.is_dir())
 
     @classmethod
     def get_recent_date_folder(cls, log_folder: pathlib.Path) -> Optional[pathlib.Path]:
@@ -39,7 +56,7 @@ class LogFolder:
         recent_date_folder = cls.get_recent_date_folder(log_folder)
         if not recent_date_folder:
             raise FileNotFoundError
-        return natsort.natsorted(list(recent_date_folder.iterdir()))
+        return natsort.natsorted(x for x in recent_date_folder.iterdir() if x.is_dir())
 
     @classmethod
     def get_recent_datetime_folder(cls, log_folder: pathlib.Path) -> Optional[pathlib.Path]:
@@ -54,9 +71,27 @@ class LogFolder:
         Accessor for the latest log folder. Recommended to call this early in execution
         (that is, before a new log folder is created)
         """
-        # Cache the latest log folder
+        # Cache the latest log folder. The catalog knows it, unless it predates the catalog (or was deleted)
         if not cls.latest_log_folder_checked:
             cls.latest_log_folder_checked = True
-            cls.latest_log_folder = cls.get_recent_datetime_folder(log_folder)
+            catalog = Catalog(log_folder)
+            latest = catalog.latest()
+            if latest is None or not latest.is_dir():
+                # Picks up the runs on disk, and repairs a latest run deleted by hand
+                catalog.reconcile()
+                latest = catalog.latest()
+                if latest is None:
+                    raise FileNotFoundError(f"No run under {log_folder}")
+            cls.latest_log_folder = latest
 
         return cls.latest_log_folder
+
+    @classmethod
+    def get_runs(cls, log_folder: pathlib.Path) -> List[dict]:
+        """
+        Every run logged under a config name, oldest first, as recorded in its catalog
+        :param log_folder: The log folder of the config name (<log dir>/<name>)
+        """
+        catalog = Catalog(log_folder)
+        catalog.reconcile()
+        return catalog.runs()
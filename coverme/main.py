@@ -1,17 +1,33 @@
 import argparse
 import datetime
+import functools
+import pathlib
+import threading
+import time
+from typing import List, Optional, Tuple
 
+# Not deferred: the template below needs confuse, and every run logs and analyzes (the modules below import numpy and
+# pandas anyway)
+import confuse
 from loguru import logger
 import numpy as np
-import tabulate
+import pandas as pd
 
 from . import definitions
 from . import conguru
+from . import output
+from . import snapshot
 from .version import __version__
-from .analysis import Analysis
-from .cache import Cache
+from .analysis import Analysis, horizon_bounds
+from .cache import Cache, SharedCache
+from .catalog import RetentionPolicy
 from .config import coverme_config
-from .tradier import TradierApi, open_session
+from .fetcher import Fetcher
+from .freshness import FreshnessPolicy, MarketCalendar
+from .metrics import metrics
+from .screening import Screen
+from .sharding import ShardPool
+from .tradier import RateLimiter, TradierApi, expiration_dates, open_session
 
 
 template = {
@@ -19,151 +35,329 @@ template = {
     'name': str,
     # True to use cache instead of the servers
     "use_cache": bool,
+    # For the implied volatility and the odds of assignment
+    'risk_free_rate': confuse.Number(),
+    # What is worth printing. See config_default.yaml
+    'screening': {
+        'strike_above_stock': bool,
+        'min_bid': confuse.Number(),
+        'min_apr': confuse.Number(),
+        'breakeven_above_stock': bool,
+        'max_prob_itm': confuse.Number(),
+    },
 }
 
 
+def open_market_api() -> TradierApi:
+    """
+    Setup the session and the API on top of it, per the "tradier" config
+    """
+    tradier_config = coverme_config['tradier']
+    # Opened by the first request, if any: a run served from the cache never loads the network stack
+    session = functools.partial(
+        open_session,
+        tradier_config['key'].get(),
+        pool_size=tradier_config['concurrency'].get(int),
+    )
+    base_url = tradier_config['base_url'].get()
+    return TradierApi(session, base_url, RateLimiter(tradier_config['requests_per_second'].as_number()),
+                      quote_batch_chars=tradier_config['quote_batch_chars'].get(int),
+                      max_retries=tradier_config['max_retries'].get(int),
+                      backoff_factor=tradier_config['backoff_factor'].as_number())
+
+
+def open_shared_cache(log_dir: pathlib.Path) -> Optional[SharedCache]:
+    """
+    The cache shared with other configs per the "cache" config, None if there is none
+    :param log_dir: The root of the logs
+    """
+    shared_dir = coverme_config['cache']['shared_dir'].get(str)
+    # Relative to the log dir. An absolute path replaces it
+    return SharedCache(log_dir / shared_dir) if shared_dir else None
+
+
+def open_cache(src_root: pathlib.Path, dst_root: pathlib.Path, use_cache: bool,
+               shared: SharedCache = None) -> Cache:
+    """
+    Setup the cache per the "cache" config
+    :param shared: As from open_shared_cache()
+    """
+    cache_config = coverme_config['cache']
+    freshness = FreshnessPolicy(
+        ttls={name: ttl.as_number() for name, ttl in cache_config['ttl'].items()},
+        calendar=MarketCalendar() if cache_config['market_hours'].get(bool) else None,
+    )
+    return Cache(src_root=src_root,
+                 dst_root=dst_root,
+                 use_cache=use_cache,
+                 backend=cache_config['backend'].get(str),
+                 freshness=freshness,
+                 write_behind=cache_config['write_behind'].get(bool),
+                 max_queued=cache_config['write_queue'].get(int),
+                 shared=shared)
+
+
+def open_screen() -> Screen:
+    """
+    The screening rules per the "screening" config
+    """
+    screening_config = coverme_config['screening']
+    return Screen(strike_above_stock=screening_config['strike_above_stock'].get(bool),
+                  min_bid=screening_config['min_bid'].as_number(),
+                  min_apr=screening_config['min_apr'].as_number(),
+                  breakeven_above_stock=screening_config['breakeven_above_stock'].get(bool),
+                  max_prob_itm=screening_config['max_prob_itm'].as_number())
+
+
+def start_pruning(shared: SharedCache = None) -> Optional[threading.Thread]:
+    """
+    Prune old runs per the "retention" config, in the background. And old entries of the shared cache, if any
+    :return: The thread doing it, None when retention is off
+    """
+    retention_config = coverme_config['retention']
+    catalog = conguru.LogFolder.catalog
+    if not retention_config['enabled'].get(bool) or catalog is None:
+        return None
+    policy = RetentionPolicy(keep_runs=retention_config['keep_runs'].get(int),
+                             keep_days=retention_config['keep_days'].as_number(),
+                             daily_snapshots=retention_config['daily_snapshots'].get(bool))
+    # This run, and the one its cache refers to
+    protect = [conguru.LogFolder.folder] + [folder for folder in [conguru.LogFolder.latest_log_folder] if folder]
+
+    @logger.catch
+    def prune():
+        with metrics.timer("prune"):
+            summary = catalog.prune(policy, protect)
+            if shared is not None:
+                # Whatever other configs still use, they fetched within keep_days
+                summary["shared_deleted"] = shared.prune(policy.keep_days * 24 * 3600)
+        logger.info("Retention: {}", summary)
+
+    thread = threading.Thread(target=prune, name="prune")
+    thread.start()
+    return thread
+
+
+def fetch(cache: Cache, market_api: TradierApi, symbols: List[str], first_date: Optional[datetime.date],
+          last_date: datetime.date) -> Tuple[dict, dict, dict]:
+    """
+    Load quotes, expirations and the option chains within [first_date, last_date] through the cache
+    :return: quotes, expirations and option chains, by symbol (then by expiration for the chains)
+    """
+    fetcher = Fetcher(cache, max_workers=coverme_config['tradier']['concurrency'].get(int))
+    try:
+        # Load the symbols' quotes, all in one go
+        with metrics.timer("fetch.quotes"):
+            quotes = dict(zip(symbols, cache.load_batch(
+                "quotes",
+                lambda params_list: market_api.quotes([symbol for symbol, in params_list]),
+                [(symbol,) for symbol in symbols])))
+
+        # Load option expirations
+        with metrics.timer("fetch.expirations"):
+            expirations = dict(zip(symbols, fetcher.load_all("expiration", market_api.options_expirations,
+                                                             [(symbol,) for symbol in symbols])))
+
+        # Only fetch the chains that can fall within the time horizon
+        all_dates = {symbol: expiration_dates(expirations[symbol]) for symbol in symbols}
+        chain_params = [
+            (symbol, expiration)
+            for symbol in symbols
+            for expiration in all_dates[symbol]
+            if (first_date is None or first_date <= datetime.date.fromisoformat(expiration)) and
+            datetime.date.fromisoformat(expiration) <= last_date
+        ]
+        n_dates = sum(len(dates) for dates in all_dates.values())
+        logger.info(f"Option chains: fetching {len(chain_params)}, skipped {n_dates - len(chain_params)} "
+                    f"outside the time horizon")
+
+        # Load option chains
+        option_chains = {symbol: {} for symbol in symbols}
+        with metrics.timer("fetch.option_chains"):
+            chains = fetcher.load_all("optionchains", market_api.option_chain, chain_params)
+        for (symbol, expiration), chain in zip(chain_params, chains):
+            option_chains[symbol][expiration] = chain
+    finally:
+        # Also when a load fails, so the threads don't outlive the run
+        fetcher.close()
+
+    logger.info(f"Cache: {cache.hits + cache.expired} hits ({cache.hits} fresh, {cache.expired} expired-refetched), "
+                f"{cache.misses} misses" +
+                ("" if cache.shared is None else f", {cache.shared_hits} of the rest from the shared cache"))
+
+    return quotes, expirations, option_chains
+
+
+def rank(analysis: Analysis, omit_dominated: bool, screen: Screen = None) -> pd.DataFrame:
+    """
+    The candidates worth printing, best first
+    :param analysis: The analysis to rank
+    :param omit_dominated: Drop anything objectively beaten by another option
+    :param screen: What is worth printing. Defaults to Screen()
+    :return: The ranked table, still in numeric units
+    """
+    screen = Screen() if screen is None else screen
+    df_apr = analysis.df_apr_objective_omit if omit_dominated else analysis.df_apr
+
+    # Filter and order columns for printing
+    df_output = df_apr[
+        ["symbol", "net_premium_adj_apr", "net_premium_per_contract",
+         "commitment_value_per_contract", "commitment_period",
+         "bid", "last_stock", "strike", "breakeven_price", "net_premium_adj_ratio", "stock_to_strike_ratio",
+         "harmonic_ratio", "implied_volatility", "delta", "prob_itm",
+         "expiration_date"
+        ] + (["omit"] if omit_dominated else [])]
+
+    # Sort for printing, by harmonic %
+    df_output = df_output.sort_values('harmonic_ratio', ascending=False)
+
+    df_output = screen.apply(df_output, omit_dominated)
+    if omit_dominated:
+        # Empty for every row left, once the dominated ones are removed
+        df_output = df_output.drop(columns="omit")
+    return df_output
+
+
+def render(df_output: pd.DataFrame, symbols: List[str], fmt: str = "table", path: pathlib.Path = None):
+    """
+    Print the ranked table itemized by symbols, then all together. Or write it as records for other tools
+    :param df_output: As from rank()
+    :param symbols: The order to itemize in
+    :param fmt: "table", or one of output.RECORD_FORMATS
+    :param path: Where to write records. None for stdout
+    """
+    if fmt == "table":
+        output.print_tables(df_output, symbols)
+    else:
+        output.write_records(df_output, fmt, path)
+
+
 def main(argv):
     parser = argparse.ArgumentParser(description="Tool for covered calls")
     conguru.add_argument(parser, definitions.CONFIG_DIR / "config.yml")
     parser.add_argument("--cache", dest="use_cache", action="store_true",
                         help="Force to use locally cached data")
+    parser.add_argument("--watch", type=float, metavar="INTERVAL",
+                        help="Keep running, refreshing every INTERVAL seconds")
+    parser.add_argument("--format", choices=["table"] + output.RECORD_FORMATS, default="table",
+                        help="Print tables, or write records for other tools")
+    parser.add_argument("--output",
+                        help="File to write records to (default: stdout)")
+    parser.add_argument("--log-dir", default=str(definitions.LOG_DIR),
+                        help="The root of the logs")
     args = parser.parse_args(argv)
+    if args.format == "parquet" and args.output is None:
+        # Before any fetching: parquet can't go to stdout
+        parser.error("--format parquet needs --output")
 
     # Conguru -- parse config and setup logging
-    conguru.init(args, argv, coverme_config, template, definitions.LOG_DIR, __version__)
+    with metrics.timer("config_init"):
+        conguru.init(args, argv, coverme_config, template, pathlib.Path(args.log_dir), __version__)
 
-    # Setup the session
-    session = open_session(
-        coverme_config['tradier']['key'].get()
-    )
-    base_url = coverme_config['tradier']['base_url'].get()
-    market_api = TradierApi(session, base_url)
+    status = "failed"
+    try:
+        run(args)
+        status = "ok"
+    except KeyboardInterrupt:
+        # The way out of --watch. Not a failure: no traceback
+        logger.info("Stopped")
+        status = "interrupted"
+    finally:
+        # Next to event.log
+        metrics.write(conguru.LogFolder.folder / "metrics.json")
+        conguru.LogFolder.finish(status)
+
+
+def run(args):
+    """
+    Everything after the config is parsed: fetch, analyze and print (repeatedly, with --watch)
+    """
+    market_api = open_market_api()
 
     # Setup the cache to use the log folders
     use_cache = coverme_config['use_cache'].get()
-    cache = Cache(src_root=conguru.LogFolder.latest_log_folder / "cache",
-                  dst_root=conguru.LogFolder.folder / "cache",
-                  use_cache=use_cache)
+    dst_root = conguru.LogFolder.folder / "cache"
+    # The very first run of a config has no previous cache: start from its own empty one
+    latest = conguru.LogFolder.latest_log_folder
+    src_root = dst_root if latest is None else latest / "cache"
 
-    # Load the symbols' quotes
     symbols = coverme_config['symbols'].get()
-    quotes = {
-        symbol: cache.load("quotes", market_api.quote, (symbol,))
-        for symbol in symbols
-    }
-
-    # Load option expirations
-    expirations = {
-        symbol: cache.load("expiration", market_api.options_expirations, (symbol,))
-        for symbol in symbols
-    }
-
-    # Load option chains
-    option_chains = {
-        symbol: {
-            expiration: cache.load("optionchains", market_api.option_chain, (symbol, expiration))
-            for expiration in expirations[symbol]['expirations']['date']
-        }
-        for symbol in symbols
-    }
-
-    logger.info(f"Cache: {cache.hits} hits, {cache.misses} misses")
-
-    # Convert to data frames (and setup metrics)
-    anaysis = Analysis(quotes, expirations, option_chains)
-    anaysis.set_time_horizon(datetime.timedelta(days=7))
-
-    # Grab the data
-    more_columns = []
-    if False:
-        # Slow filters -- These are O(n^2) filters
-        df_apr = anaysis.df_apr_objective_omit
-
-        def omitter(row):
-            filtered = row.values[row.values != np.array(None)]
-            filtered = np.unique(filtered).tolist()
-            if len(filtered) == 0:
-                return ''
-            else:
-                return ', '.join([str(x) for x in filtered])
-
-        df_apr['omit'] = df_apr[[
-            # Kept as separate lines to they are easy to add/remove
-            "worse_apr_strike",
-            "worse_premium_expiry",
-            "worse_strike_expiry",
-        ]].apply(
-            omitter,
-            axis=1
-        )
-        more_columns += "omit"
+    time_horizon = datetime.timedelta(days=coverme_config['horizon_days'].get(int))
+    # Everything is fetched and analyzed out to the longest horizon, then split
+    time_horizons = sorted({time_horizon} | {datetime.timedelta(days=days)
+                                             for days in coverme_config['compare_horizons_days'].get(list)})
+    compare_top = coverme_config['compare_top'].get(int)
+    min_dte = coverme_config['min_dte'].get(int)
+    min_time = datetime.timedelta(days=min_dte) if min_dte else None
+    omit_dominated = coverme_config['omit_dominated'].get(bool)
 
-    else:
-        # Quick filters
-        df_apr = anaysis.df_apr
+    workers = coverme_config['analysis_workers'].get(int)
+    pool = ShardPool(workers) if workers > 1 else None
+    ratio_dtype = np.float32 if coverme_config['ratio_float32'].get(bool) else np.float64
+    risk_free_rate = coverme_config['risk_free_rate'].as_number()
+    screen = open_screen()
+    shared = open_shared_cache(pathlib.Path(args.log_dir))
+    keep_snapshot = coverme_config['snapshot'].get(bool)
 
-    # Filter and order columns for printing
-    df_output = df_apr[
-        ["symbol", "net_premium_adj_apr", "net_premium_per_contract",
-         "commitment_value_per_contract", "commitment_period",
-         "bid", "last_stock", "strike", "breakeven_price", "net_premium_adj_ratio", "stock_to_strike_ratio",
-         "harmonic_ratio",
-         "expiration_date"
-        ] + more_columns]
+    anaysis = None
+    df_previous = None
+    pruner = None
+    while True:
+        cycle_start = time.monotonic()
 
-    # Sort for printing
-    # Sort by Premium %
-    if False:
-        df_output = df_output.sort_values('net_premium_adj_apr', ascending=False)
-    else:
-        # Sort by harmonic %
-        df_output = df_output.sort_values('harmonic_ratio', ascending=False)
-
-    # Remove anything with an APR under 7%
-    df_output = df_output[df_output["net_premium_adj_apr"] > 7]
-    # Remove anything where there's no way to make money
-    df_output = df_output[df_output['breakeven_price'] > df_output["last_stock"]]
-    # Remove anything marked to omit
-    #df_output = df_output[df_output["omit"] == '']
-    # Remove strike prices below the current stock price
-    df_output = df_output[df_output['strike'] > df_output['last_stock']]
-
-    # Fix units for printing
-    df_output['net_premium_adj_apr'] = df_output['net_premium_adj_apr'].map(lambda x: f"{x:>5.1f}%")
-    df_output['net_premium_per_contract'] = df_output['net_premium_per_contract'].map(lambda x: f"${x:.2f}")
-    df_output['commitment_value_per_contract'] = df_output['commitment_value_per_contract'].map(lambda x: f"${x:.2f}")
-    df_output['commitment_period'] = df_output['commitment_period'].map(lambda x: f"{x.days} days")
-    df_output['bid'] = df_output['bid'].map(lambda x: f"${x:.2f}")
-    df_output['last_stock'] = df_output['last_stock'].map(lambda x: f"${x:.2f}")
-    df_output['strike'] = df_output['strike'].map(lambda x: f"${x:.2f}")
-    df_output['breakeven_price'] = df_output['breakeven_price'].map(lambda x: f"${x:.2f}")
-    df_output["stock_to_strike_ratio"] = df_output['stock_to_strike_ratio'].map(lambda x: f"{x * 100:5.1f}%")
-    df_output['net_premium_adj_ratio'] = df_output['net_premium_adj_ratio'].map(lambda x: f"{x * 100:5.1f}%")
-    df_output['harmonic_ratio'] = df_output['harmonic_ratio'].map(lambda x: f"{x * 100:5.1f}%")
-
-    # Rename for printing
-    df_output = df_output.rename(columns={'net_premium_adj_apr': "APR",
-                                          "net_premium_per_contract": "Premium /\n contract",
-                                          "commitment_value_per_contract": "Commitment /\n contract",
-                                          "commitment_period": "Expiry\nperiod",
-                                          "last_stock": "Stock\nprice",
-                                          "strike": "Strike\nprice",
-                                          "expiration_date": "Expiry",
-                                          "breakeven_price": "Break-even\nprice",
-                                          "stock_to_strike_ratio": "% to strike",
-                                          "net_premium_adj_ratio": "Premium %",
-                                          "harmonic_ratio": "Harmonic %",
-                                          })
-
-    # Print itemized by symbols
-    for symbol in symbols:
-        where = (df_output["symbol"] == symbol)
-        if len(df_output[where]) == 0:
-            print(f"Skipping {symbol}")
-            continue
-        print(tabulate.tabulate(df_output[where],
-                                headers='keys', tablefmt='psql', colalign=("right",) * len(df_output.columns)))
-
-    # Then print everything
-    print(tabulate.tabulate(df_output,
-                            headers='keys', tablefmt='psql', colalign=("right",) * len(df_output.columns)))
+        # Pruning must not overlap with the cache, which may refer to the runs being pruned
+        if pruner is not None:
+            pruner.join()
+        cache = open_cache(src_root, dst_root, use_cache, shared)
+        first_date, last_date = horizon_bounds(time_horizons[-1], min_time)
+        quotes, expirations, option_chains = fetch(cache, market_api, symbols, first_date, last_date)
+        cache.close()
+        if anaysis is None:
+            pruner = start_pruning(shared)
+
+        # Convert to data frames (and setup metrics). While watching, only what changed is recomputed
+        unchanged = 0
+        if anaysis is None or anaysis.today != datetime.date.today() - datetime.timedelta(days=1):
+            anaysis = Analysis(quotes, expirations, option_chains, pool=pool, ratio_dtype=ratio_dtype,
+                               screen=screen, risk_free_rate=risk_free_rate)
+            anaysis.set_time_horizons(time_horizons, min_time)
+        else:
+            unchanged = anaysis.update(quotes, expirations, option_chains)
+
+        with metrics.timer("filter"):
+            df_ranked = rank(anaysis, omit_dominated, screen)
+            views = anaysis.horizon_views(df_ranked)
+        if df_previous is not None and df_ranked.equals(df_previous):
+            logger.info("Ranking unchanged")
+        else:
+            with metrics.timer("render"):
+                render(views[time_horizon], symbols, args.format,
+                       None if args.output is None else pathlib.Path(args.output))
+                if len(views) > 1 and args.format == "table":
+                    output.print_horizons({f"{horizon.days} days": view for horizon, view in views.items()},
+                                          compare_top)
+            if keep_snapshot:
+                with metrics.timer("snapshot"):
+                    snapshot.write(conguru.LogFolder.folder / snapshot.SNAPSHOT_DIRNAME, anaysis, time_horizon,
+                                   omit_dominated, screen)
+            df_previous = df_ranked
+
+        logger.info("Analysis frames built: {}", dict(anaysis.build_counts))
+        # Pushed down rules only count the chains read this cycle
+        logger.info("Screening removed: {}", dict(screen.removed))
+        screen.removed.clear()
+        if args.watch is None:
+            if pruner is not None:
+                pruner.join()
+            if pool is not None:
+                pool.close()
+            break
+
+        n_chains = sum(len(chains) for chains in option_chains.values())
+        elapsed = time.monotonic() - cycle_start
+        logger.info(f"Cycle took {elapsed:.2f}s, {unchanged} of {n_chains} chains unchanged")
+
+        # Later cycles refresh this run's own cache. Freshness decides what is fetched again
+        src_root = dst_root
+        use_cache = False
+        time.sleep(max(0.0, args.watch - elapsed))
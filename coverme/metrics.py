@@ -0,0 +1,82 @@
+"""
+Where runs spend their time: timers around phases and a record of every API request
+"""
+import collections
+import contextlib
+import json
+import math
+import pathlib
+import threading
+import time
+from typing import Dict, List, Optional
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """
+    Nearest-rank percentile
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._phases: Dict[str, List[float]] = collections.defaultdict(list)
+        self._requests: Dict[str, List[tuple]] = collections.defaultdict(list)
+
+    @contextlib.contextmanager
+    def timer(self, name: str):
+        """
+        Time a phase. The same phase may be timed several times (e.g. once per --watch cycle)
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._phases[name].append(elapsed)
+
+    def record_request(self, endpoint: str, seconds: float, status: Optional[int], size: int):
+        """
+        :param endpoint: The path requested
+        :param seconds: Latency, including retries
+        :param status: HTTP status, None when no response came back
+        :param size: Bytes of the response body
+        """
+        with self._lock:
+            self._requests[endpoint].append((seconds, status, size))
+
+    def summary(self) -> dict:
+        with self._lock:
+            phases = {name: list(times) for name, times in self._phases.items()}
+            requests = {endpoint: list(records) for endpoint, records in self._requests.items()}
+
+        summary = {"phases": {}, "requests": {}}
+        for name, times in phases.items():
+            summary["phases"][name] = {"count": len(times), "total_seconds": sum(times), "max_seconds": max(times)}
+        for endpoint, records in requests.items():
+            latencies = [seconds for seconds, _, _ in records]
+            sizes = [size for _, _, size in records]
+            statuses = collections.Counter(str(status) for _, status, _ in records)
+            summary["requests"][endpoint] = {
+                "count": len(records),
+                "errors": sum(1 for _, status, _ in records if status != 200),
+                "statuses": dict(statuses),
+                "latency_seconds": {f"p{q}": percentile(latencies, q) for q in PERCENTILES},
+                "bytes": {**{f"p{q}": percentile(sizes, q) for q in PERCENTILES}, "total": sum(sizes)},
+            }
+        return summary
+
+    def write(self, path: pathlib.Path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+# Singleton metrics for the app
+metrics = Metrics()
@@ -0,0 +1,172 @@
+"""
+Output of the ranked table: human-readable tables, or machine-readable records
+"""
+import pathlib
+import sys
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+# How each column is printed, as a %-format applied to the whole column at once (and a scale applied first)
+COLUMN_FORMATS = {
+    "net_premium_adj_apr": ("%5.1f%%", 1),
+    "net_premium_per_contract": ("$%.2f", 1),
+    "commitment_value_per_contract": ("$%.2f", 1),
+    "bid": ("$%.2f", 1),
+    "last_stock": ("$%.2f", 1),
+    "strike": ("$%.2f", 1),
+    "breakeven_price": ("$%.2f", 1),
+    "stock_to_strike_ratio": ("%5.1f%%", 100),
+    "net_premium_adj_ratio": ("%5.1f%%", 100),
+    "harmonic_ratio": ("%5.1f%%", 100),
+    "implied_volatility": ("%5.1f%%", 100),
+    "delta": ("%.2f", 1),
+    "prob_itm": ("%5.1f%%", 100),
+}
+
+# Headers for printing
+COLUMN_NAMES = {
+    'net_premium_adj_apr': "APR",
+    "net_premium_per_contract": "Premium /\n contract",
+    "commitment_value_per_contract": "Commitment /\n contract",
+    "commitment_period": "Expiry\nperiod",
+    "last_stock": "Stock\nprice",
+    "strike": "Strike\nprice",
+    "expiration_date": "Expiry",
+    "breakeven_price": "Break-even\nprice",
+    "stock_to_strike_ratio": "% to strike",
+    "net_premium_adj_ratio": "Premium %",
+    "harmonic_ratio": "Harmonic %",
+    "implied_volatility": "Implied\nvolatility",
+    "delta": "Delta",
+    "prob_itm": "Assignment\nodds",
+}
+
+# Columns of each horizon when comparing horizons side by side
+HORIZON_COLUMNS = ["symbol", "strike", "expiration_date", "net_premium_adj_apr", "harmonic_ratio"]
+
+# Machine-readable formats, by name
+RECORD_FORMATS = ["csv", "jsonl", "parquet"]
+
+
+def format_table(df_output: pd.DataFrame) -> pd.DataFrame:
+    """
+    Fix units for printing, a column at a time
+    :param df_output: The ranked table, in numeric units
+    :return: The same table as text, with printable headers
+    """
+    df_output = df_output.copy()
+    for column, (fmt, scale) in COLUMN_FORMATS.items():
+        values = df_output[column].to_numpy(dtype=np.float64) * scale
+        df_output[column] = np.char.mod(fmt, values).astype(object)
+    df_output['commitment_period'] = df_output['commitment_period'].astype(str) + " days"
+    df_output['expiration_date'] = df_output['expiration_date'].dt.date
+
+    return df_output.rename(columns=COLUMN_NAMES)
+
+
+def _tabulate(df: pd.DataFrame) -> str:
+    # Imported when first needed: record formats never print a table
+    import tabulate
+
+    # Cells are formatted already: numparse would turn "0.10" back into 0.1. The index is a column too, the first
+    return tabulate.tabulate(df, headers='keys', tablefmt='psql', colalign=("right",) * (len(df.columns) + 1),
+                             disable_numparse=True)
+
+
+def print_tables(df_output: pd.DataFrame, symbols: List[str]):
+    """
+    Print the ranked table itemized by symbols, then all together
+    :param df_output: The ranked table, in numeric units
+    :param symbols: The order to itemize in
+    """
+    df_output = format_table(df_output)
+
+    # Print itemized by symbols, splitting the table in a single pass
+    by_symbol = dict(iter(df_output.groupby("symbol", sort=False, observed=True)))
+    for symbol in symbols:
+        if symbol not in by_symbol:
+            print(f"Skipping {symbol}")
+            continue
+        print(_tabulate(by_symbol[symbol]))
+
+    # Then print everything
+    print(_tabulate(df_output))
+
+
+def print_horizons(views: Dict[str, pd.DataFrame], top: int):
+    """
+    Print the best candidates of each horizon side by side
+    :param views: The ranked table (in numeric units) within each horizon, by name of the horizon
+    :param top: Candidates per horizon
+    """
+    blocks = []
+    headers = []
+    for name, df_view in views.items():
+        block = format_table(df_view.head(top))[[COLUMN_NAMES.get(column, column) for column in HORIZON_COLUMNS]]
+        blocks.append(block.astype(object).reset_index(drop=True))
+        # The name of the horizon over its first column only
+        headers += [f"{name}\n{column}" if i == 0 else f"\n{column}" for i, column in enumerate(block.columns)]
+
+    # Horizons with fewer candidates are padded
+    df_side_by_side = pd.concat(blocks, axis=1, ignore_index=True).fillna('')
+    df_side_by_side.columns = headers
+    df_side_by_side.index += 1
+    print(_tabulate(df_side_by_side))
+
+
+def print_changes(df_changes: pd.DataFrame):
+    """
+    Print what changed between two rankings
+    :param df_changes: As from snapshot.diff(): the key, a "change", and each compared column suffixed with _before
+                       and _after
+    """
+    if df_changes.empty:
+        print("No changes")
+        return
+    df_print = df_changes.astype(object)
+    headers = []
+    for column in df_changes.columns:
+        name, _, when = column.rpartition("_") if column.endswith(("_before", "_after")) else (column, "", "")
+        if name in COLUMN_FORMATS:
+            fmt, scale = COLUMN_FORMATS[name]
+            values = df_changes[column].to_numpy(dtype=np.float64) * scale
+            # Missing on the side where the candidate isn't
+            df_print[column] = np.where(np.isnan(values), '', np.char.mod(fmt, values)).astype(object)
+        headers.append(f"{COLUMN_NAMES.get(name, name)}\n{when}" if when else COLUMN_NAMES.get(name, name))
+    df_print['expiration_date'] = df_changes['expiration_date'].dt.date
+    df_print.columns = headers
+    print(_tabulate(df_print))
+
+
+def to_records(df_output: pd.DataFrame) -> pd.DataFrame:
+    """
+    The ranked table with plain types: the symbol as text and the expiry as an ISO date
+    """
+    df_records = df_output.copy()
+    df_records['symbol'] = df_records['symbol'].astype(str)
+    df_records['expiration_date'] = df_records['expiration_date'].dt.strftime('%Y-%m-%d')
+    return df_records
+
+
+def write_records(df_output: pd.DataFrame, fmt: str, path: pathlib.Path = None):
+    """
+    Write the ranked table for other tools, without any formatting for humans
+    :param df_output: The ranked table, in numeric units
+    :param fmt: One of RECORD_FORMATS. "parquet" needs pyarrow (see requirements.txt)
+    :param path: Where to write. None for stdout (not for parquet)
+    """
+    df_records = to_records(df_output)
+    if fmt == "csv":
+        df_records.to_csv(sys.stdout if path is None else path, index=False)
+    elif fmt == "jsonl":
+        df_records.to_json(sys.stdout if path is None else path, orient='records', lines=True)
+        if path is None:
+            print()
+    elif fmt == "parquet":
+        if path is None:
+            raise ValueError("Parquet output needs a file (--output)")
+        df_records.to_parquet(path, index=False)
+    else:
+        raise ValueError(f"Unknown output format: {fmt}")
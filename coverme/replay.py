@@ -0,0 +1,156 @@
+"""
+Replay the archived runs of a config: rebuild df_apr from the cache of every run, in parallel, into one columnar
+dataset with the time of each run.
+
+    python -m coverme.replay <name> [--log-dir logs] [--output replay/<name>] [--format parquet] [--workers N]
+
+The dataset is a folder with one part file per run, written as each run completes. Runs that already have their part
+are skipped, so replaying again only adds the new runs. Load it all with load().
+"""
+import argparse
+import ast
+import concurrent.futures
+import datetime
+import json
+import pathlib
+import sys
+from typing import List, Optional, Tuple
+
+import pandas as pd
+from loguru import logger
+
+from . import definitions
+from .analysis import Analysis
+from .cache import open_store
+from .log_folder import LogFolder
+
+# Formats of the part files. "parquet" needs pyarrow (see requirements.txt)
+PART_FORMATS = ["parquet", "csv"]
+
+
+def load_run(cache_folder: pathlib.Path) -> Tuple[dict, dict, dict]:
+    """
+    Everything a run fetched, from its cache
+    :return: quotes, expirations and option chains, by symbol (then by expiration for the chains)
+    """
+    store = open_store(cache_folder)
+    try:
+        quotes = {ast.literal_eval(key)[0]: json.loads(store.read("quotes", key)) for key in store.keys("quotes")}
+        expirations = {ast.literal_eval(key)[0]: json.loads(store.read("expiration", key))
+                       for key in store.keys("expiration")}
+        option_chains = {symbol: {} for symbol in quotes}
+        for key in store.keys("optionchains"):
+            symbol, expiration = ast.literal_eval(key)
+            if symbol in option_chains:
+                option_chains[symbol][expiration] = json.loads(store.read("optionchains", key))
+    finally:
+        store.close()
+    return quotes, expirations, option_chains
+
+
+def replay_run(run_folder: pathlib.Path, run_time: datetime.datetime, part_path: pathlib.Path,
+               time_horizon: Optional[datetime.timedelta] = None) -> int:
+    """
+    Rebuild df_apr of one run and write it as a part of the dataset. Runs in a worker process
+    :param run_folder: The log folder of the run
+    :param run_time: When the run started
+    :param part_path: The part file to write. Its suffix is the format
+    :param time_horizon: Only options expiring within this long of the run. None for everything it fetched
+    :return: The number of rows written
+    """
+    quotes, expirations, option_chains = load_run(run_folder / "cache")
+    analysis = Analysis(quotes, expirations, option_chains, today=run_time.date())
+    if time_horizon is not None:
+        analysis.set_time_horizon(time_horizon)
+
+    df_part = analysis.df_apr.copy()
+    df_part.insert(0, "run_time", pd.Timestamp(run_time))
+
+    # Write next to the final name, then rename: a part file that exists is complete
+    tmp_path = part_path.with_name(f".{part_path.name}.tmp")
+    if part_path.suffix == ".parquet":
+        df_part.to_parquet(tmp_path, index=False)
+    else:
+        df_part.to_csv(tmp_path, index=False)
+    tmp_path.replace(part_path)
+    return len(df_part)
+
+
+def replay(log_folder: pathlib.Path, output: pathlib.Path, fmt: str = "parquet", workers: int = None,
+           time_horizon: Optional[datetime.timedelta] = None) -> Tuple[int, int, int]:
+    """
+    Replay every run under a config's log folder that has a cache and no part yet
+    :param log_folder: The log folder of the config name (<log dir>/<name>)
+    :param output: The dataset folder
+    :param fmt: One of PART_FORMATS
+    :param workers: Processes to use. None for one per CPU
+    :param time_horizon: See replay_run()
+    :return: The number of runs replayed, of rows written, and of runs skipped because they failed
+    """
+    output.mkdir(parents=True, exist_ok=True)
+    jobs = []
+    for run in LogFolder.get_runs(log_folder):
+        run_folder = log_folder / run["path"]
+        part_path = output / f"{run_folder.name}.{fmt}"
+        if run["status"] == "running" or not (run_folder / "cache").is_dir() or part_path.exists():
+            continue
+        jobs.append((run_folder, datetime.datetime.fromisoformat(run["start_time"]), part_path))
+    logger.info("Replaying {} runs into {}", len(jobs), output)
+
+    n_rows = 0
+    n_runs = 0
+    n_failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(replay_run, run_folder, run_time, part_path, time_horizon): run_folder
+                   for run_folder, run_time, part_path in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                n_rows += future.result()
+                n_runs += 1
+            except Exception as ex:
+                # One damaged run shouldn't cost the whole history
+                logger.warning("Skipping {}: {!r}", futures[future], ex)
+                n_failed += 1
+    logger.info("Replayed {} runs, {} rows", n_runs, n_rows)
+    return n_runs, n_rows, n_failed
+
+
+def load(output: pathlib.Path) -> pd.DataFrame:
+    """
+    The whole dataset, ordered by run
+    """
+    parts: List[pd.DataFrame] = []
+    for part_path in sorted(output.glob("*.parquet")):
+        parts.append(pd.read_parquet(part_path))
+    for part_path in sorted(output.glob("*.csv")):
+        parts.append(pd.read_csv(part_path, parse_dates=["run_time", "expiration_date"]))
+    if not parts:
+        return pd.DataFrame()
+    return pd.concat(parts, ignore_index=True).sort_values("run_time", kind="stable", ignore_index=True)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Rebuild the analysis of every archived run into one dataset")
+    parser.add_argument("name", help="The config name (the folder under the log dir)")
+    parser.add_argument("--log-dir", type=pathlib.Path, default=definitions.LOG_DIR,
+                        help="The root of the logs")
+    parser.add_argument("--output", type=pathlib.Path,
+                        help="The dataset folder (default: replay/<name>)")
+    parser.add_argument("--format", choices=PART_FORMATS, default="parquet",
+                        help="Format of the part files")
+    parser.add_argument("--workers", type=int,
+                        help="Processes to use (default: one per CPU)")
+    parser.add_argument("--horizon-days", type=int,
+                        help="Only options expiring within this many days of each run (default: all fetched)")
+    args = parser.parse_args(argv)
+
+    output = args.output or definitions.ROOT_DIR / "replay" / args.name
+    time_horizon = None if args.horizon_days is None else datetime.timedelta(days=args.horizon_days)
+    n_runs, _, n_failed = replay(args.log_dir / args.name, output, args.format, args.workers, time_horizon)
+    if n_failed and not n_runs:
+        # Something wrong with every run (e.g. the format can't be written), rather than a damaged one
+        sys.exit(f"None of the {n_failed} runs could be replayed")
+
+
+if "__main__" == __name__:
+    main(sys.argv[1:])
@@ -0,0 +1,83 @@
+"""
+Which options are worth printing. The rules that only need a contract and its stock's price, and can't change which
+contracts the dominance rules beat, are pushed down into reading the chains (see ingest.chain_columns), so the
+contracts they reject never reach the metrics or the dominance rules. The others apply to the ranked table.
+"""
+import collections
+
+import numpy as np
+import pandas as pd
+
+
+class Screen:
+    def __init__(self, strike_above_stock: bool = True, min_bid: float = 0.0, min_apr: float = 7.0,
+                 breakeven_above_stock: bool = True, max_prob_itm: float = 1.0):
+        """
+        :param strike_above_stock: Only strikes above the stock price. Pushed down
+        :param min_bid: Lowest bid worth printing, 0 for any. An option bid lower still beats others with the
+                        dominance rules, so it is not pushed down
+        :param min_apr: Lowest APR worth printing, in percent
+        :param breakeven_above_stock: Only options that can make money
+        :param max_prob_itm: Highest odds of the stock being called away worth printing, 1 for any. Options whose
+                             odds are unknown (no implied volatility) are removed too
+        """
+        self.strike_above_stock = strike_above_stock
+        self.min_bid = min_bid
+        self.min_apr = min_apr
+        self.breakeven_above_stock = breakeven_above_stock
+        self.max_prob_itm = max_prob_itm
+        # Rows removed by each rule, until cleared
+        self.removed = collections.Counter()
+
+    @property
+    def settings(self) -> dict:
+        """
+        The rules, as the constructor takes them
+        """
+        return {"strike_above_stock": self.strike_above_stock, "min_bid": self.min_bid, "min_apr": self.min_apr,
+                "breakeven_above_stock": self.breakeven_above_stock, "max_prob_itm": self.max_prob_itm}
+
+    def pushdown(self, keep: np.ndarray, strike: np.ndarray, last_stock: np.ndarray) -> np.ndarray:
+        """
+        The rules on the chain alone that can go before the dominance rules without changing anything for the rows
+        left: a contract can only be beaten by one with a strike at least as high, so never by one below the stock
+        price. Not min_bid: a contract bid lower can still beat another (by worse_strike_expiry, with a sooner expiry
+        and an APR within a point), so it is only dropped from the ranked table
+        :param keep: Rows still in
+        :param strike: Per row
+        :param last_stock: Last price of each row's stock
+        :return: keep, less what the rules removed
+        """
+        rules = []
+        if self.strike_above_stock:
+            rules.append(("strike > last_stock", strike > last_stock))
+        for rule, passed in rules:
+            self.removed[rule] += int(np.count_nonzero(keep & ~passed))
+            keep = keep & passed
+        return keep
+
+    def apply(self, df_output: pd.DataFrame, omit_dominated: bool) -> pd.DataFrame:
+        """
+        Every rule, on the ranked table, after the dominance rules. The pushed down rules again too, for an analysis
+        built without them
+        :param df_output: Has the columns of main.rank()
+        :param omit_dominated: Also remove the rows marked to omit
+        """
+        rules = [(f"net_premium_adj_apr > {self.min_apr}", lambda df: df["net_premium_adj_apr"] > self.min_apr)]
+        if self.breakeven_above_stock:
+            # Otherwise there's no way to make money
+            rules.append(("breakeven_price > last_stock", lambda df: df["breakeven_price"] > df["last_stock"]))
+        if self.max_prob_itm < 1:
+            rules.append((f"prob_itm <= {self.max_prob_itm}", lambda df: df["prob_itm"] <= self.max_prob_itm))
+        if omit_dominated:
+            rules.append(("dominated", lambda df: df["omit"] == ''))
+        if self.strike_above_stock:
+            rules.append(("strike > last_stock", lambda df: df["strike"] > df["last_stock"]))
+        if self.min_bid > 0:
+            rules.append((f"bid >= {self.min_bid}", lambda df: df["bid"] >= self.min_bid))
+
+        for rule, passes in rules:
+            passed = passes(df_output)
+            self.removed[rule] += int(len(passed) - passed.sum())
+            df_output = df_output[passed]
+        return df_output
@@ -0,0 +1,78 @@
+"""
+The dominance rules over shards of symbols, in a process pool. Rules never cross symbols, so splitting the rows at
+symbol boundaries gives exactly the results of a single process.
+"""
+import concurrent.futures
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from . import dominance
+
+# Below this many rows, the round trip to the workers costs more than it saves
+MIN_ROWS = 20000
+# Shards per worker. A few each, so one slow shard doesn't hold the others up
+SHARDS_PER_WORKER = 4
+
+
+def shard_bounds(symbol: np.ndarray, shards: int) -> List[Tuple[int, int]]:
+    """
+    Split rows into about equally sized runs of whole symbols
+    :param symbol: Symbol code per row. Each symbol's rows are together
+    :param shards: How many runs to aim for
+    :return: [start, stop) of each run
+    """
+    n_rows = len(symbol)
+    starts = np.flatnonzero(np.r_[True, symbol[1:] != symbol[:-1]]) if n_rows else np.zeros(0, dtype=np.int64)
+    # The symbol start nearest after each ideal cut
+    ideal = np.arange(1, shards) * n_rows / shards
+    cuts = starts[np.minimum(np.searchsorted(starts, ideal), len(starts) - 1)] if len(starts) else []
+    bounds = np.unique(np.r_[0, cuts, n_rows]).tolist()
+    return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if start < stop]
+
+
+def _noop():
+    pass
+
+
+class ShardPool:
+    def __init__(self, workers: int, min_rows: int = MIN_ROWS):
+        """
+        :param workers: Processes to run shards on
+        :param min_rows: Smaller tables are done in this process
+        """
+        # Imported here: most runs do everything in one process and never need it
+        import multiprocessing
+
+        self.workers = workers
+        self.min_rows = min_rows
+        # Spawned rather than forked: the app has threads (fetching, pruning) that a fork would copy mid-flight
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        # Start the workers now, while there is other work to do (they each import numpy and pandas)
+        self._executor.submit(_noop)
+
+    def dominators(self, symbol: np.ndarray, expiration: np.ndarray, apr: np.ndarray, premium: np.ndarray,
+                   strike: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Same as dominance.dominators
+        :param symbol: Symbol code per row (integers pickle much smaller than names). Each symbol's rows are together
+        """
+        columns = (symbol, expiration, apr, premium, strike)
+        if len(symbol) < self.min_rows or len(symbol) == 0:
+            return dominance.dominators(*columns)
+
+        bounds = shard_bounds(symbol, self.workers * SHARDS_PER_WORKER)
+        futures = [self._executor.submit(dominance.dominators, *(column[start:stop] for column in columns))
+                   for start, stop in bounds]
+
+        # Positions come back relative to their shard
+        parts = [(start, future.result()) for (start, _), future in zip(bounds, futures)]
+        return {
+            rule: np.concatenate([np.where(positions[rule] >= 0, positions[rule] + start, -1)
+                                  for start, positions in parts])
+            for rule in parts[0][1]
+        }
+
+    def close(self):
+        self._executor.shutdown()
@@ -0,0 +1,269 @@
+"""
+The analysis of a run, kept in its log folder as one .npy file per column. Loading maps the files rather than reading
+them, so the results of a past run are back in milliseconds, without its cache or any recomputing.
+
+    python -m coverme.snapshot <name> [--log-dir logs] [--run <date>/<time>] [--format table]
+    python -m coverme.snapshot <name> --diff [--run <date>/<time>] [--against <date>/<time>]
+
+The first prints the tables of a run again (by default the latest with a snapshot). The second lists the candidates
+that appeared, went away or changed since the run before it (or since --against).
+"""
+import argparse
+import datetime
+import json
+import pathlib
+import shutil
+import sys
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from . import definitions
+from . import dominance
+from . import output
+from .analysis import Analysis, split_horizons
+from .log_folder import LogFolder
+from .screening import Screen
+
+# The snapshot folder, in the log folder of a run
+SNAPSHOT_DIRNAME = "analysis"
+# What is in it. Written last: a folder without it is no snapshot
+MANIFEST_FILENAME = "columns.json"
+# Bumped whenever the layout changes
+SNAPSHOT_VERSION = 1
+
+# Identifies a candidate across runs
+DIFF_KEY = ["symbol", "expiration_date", "strike"]
+# What is compared between runs
+DIFF_COLUMNS = ["net_premium_adj_apr", "bid"]
+
+
+def write(folder: pathlib.Path, analysis: Analysis, time_horizon: datetime.timedelta, omit_dominated: bool,
+          screen: Screen):
+    """
+    Save the analysis as a snapshot, replacing any already in folder
+    :param folder: Where to (SNAPSHOT_DIRNAME in a log folder)
+    :param analysis: With its horizons set. df_apr is saved, and its dominance rules when omit_dominated
+    :param time_horizon: The horizon printed, one of analysis.time_horizons
+    :param omit_dominated: As given to main.rank()
+    :param screen: As given to main.rank(), to rank the same way once loaded
+    """
+    df_apr = analysis.df_apr
+
+    # Written next to the final folder, then swapped in: a reader sees a whole snapshot or none
+    tmp = folder.with_name(f".{folder.name}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    columns = []
+    np.save(tmp / "index.npy", df_apr.index.to_numpy())
+    for name, series in df_apr.items():
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # The codes, which map as they are. The categories are few
+            np.save(tmp / f"{name}.npy", series.cat.codes.to_numpy())
+            columns.append({"name": name, "categories": list(series.cat.categories)})
+        else:
+            np.save(tmp / f"{name}.npy", series.to_numpy())
+            columns.append({"name": name})
+
+    rules = []
+    if omit_dominated:
+        for rule, positions in analysis.dominators.items():
+            np.save(tmp / f"{rule}.npy", positions)
+            rules.append(rule)
+        # Fixed-width text: an array of objects can't be mapped
+        np.save(tmp / "omit.npy", analysis.df_apr_objective_omit["omit"].to_numpy(dtype=str))
+
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "today": analysis.today.isoformat(),
+        "time_horizon": time_horizon.days,
+        "time_horizons": [horizon.days for horizon in analysis.time_horizons],
+        "horizon_ends": [str(end) for end in analysis.horizon_ends],
+        "omit_dominated": omit_dominated,
+        "screen": screen.settings,
+        "rows": len(df_apr),
+        "columns": columns,
+        "rules": rules,
+    }
+    (tmp / MANIFEST_FILENAME).write_text(json.dumps(manifest, indent=2))
+
+    old = folder.with_name(f".{folder.name}.old")
+    shutil.rmtree(old, ignore_errors=True)
+    if folder.exists():
+        folder.rename(old)
+    tmp.rename(folder)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+class Snapshot:
+    def __init__(self, folder: pathlib.Path):
+        """
+        A snapshot, memory-mapped. Stands in for the Analysis it was written from in main.rank()
+        :param folder: As given to write()
+        """
+        self.folder = folder
+        manifest = json.loads((folder / MANIFEST_FILENAME).read_text())
+        if manifest["version"] != SNAPSHOT_VERSION:
+            raise ValueError(f"{folder} is a snapshot of version {manifest['version']}, not {SNAPSHOT_VERSION}")
+        self.today = datetime.date.fromisoformat(manifest["today"])
+        self.time_horizon = datetime.timedelta(days=manifest["time_horizon"])
+        self.time_horizons = [datetime.timedelta(days=days) for days in manifest["time_horizons"]]
+        self.horizon_ends = np.array(manifest["horizon_ends"], dtype='datetime64[D]')
+        self.omit_dominated: bool = manifest["omit_dominated"]
+        self.screen = Screen(**manifest["screen"])
+        self._columns: List[dict] = manifest["columns"]
+        self._rules: List[str] = manifest["rules"]
+        self._df_apr: Optional[pd.DataFrame] = None
+
+    def _map(self, name: str) -> np.ndarray:
+        # Read-only: the pages are the file's, shared with whatever else maps it
+        return np.load(self.folder / f"{name}.npy", mmap_mode='r')
+
+    @property
+    def symbols(self) -> List[str]:
+        return next(column["categories"] for column in self._columns if column["name"] == "symbol")
+
+    @property
+    def df_apr(self) -> pd.DataFrame:
+        """
+        Analysis.df_apr of the run, over the mapped files. Nothing is read until used
+        """
+        if self._df_apr is None:
+            columns = {}
+            for column in self._columns:
+                values = self._map(column["name"])
+                if "categories" in column:
+                    values = pd.Categorical.from_codes(values, categories=column["categories"])
+                columns[column["name"]] = values
+            self._df_apr = pd.DataFrame(columns, index=pd.Index(self._map("index")), copy=False)
+        return self._df_apr
+
+    @property
+    def dominators(self) -> Dict[str, np.ndarray]:
+        """
+        See Analysis.dominators
+        """
+        if not self._rules:
+            raise ValueError(f"{self.folder} was written without the dominance rules (omit_dominated: false)")
+        return {rule: self._map(rule) for rule in self._rules}
+
+    @property
+    def df_apr_objective_omit(self) -> pd.DataFrame:
+        """
+        See Analysis.df_apr_objective_omit
+        """
+        df_apr = self.df_apr
+        columns = {name: df_apr[name] for name in df_apr}
+        for rule, positions in self.dominators.items():
+            columns[rule] = dominance.to_labels(positions, df_apr.index)
+        columns["omit"] = self._map("omit").astype(object)
+        return pd.DataFrame(columns, copy=False)
+
+    def horizon_views(self, df: pd.DataFrame) -> Dict[datetime.timedelta, pd.DataFrame]:
+        """
+        See Analysis.horizon_views()
+        """
+        return split_horizons(df, self.time_horizons, self.horizon_ends)
+
+    def ranked(self) -> pd.DataFrame:
+        """
+        The table the run printed, ranked the way it was
+        """
+        # Imported here: main imports this module to write snapshots
+        from .main import rank
+        df_ranked = rank(self, self.omit_dominated, self.screen)
+        return self.horizon_views(df_ranked)[self.time_horizon]
+
+
+def find_runs(log_folder: pathlib.Path) -> List[pathlib.Path]:
+    """
+    The log folders of the runs with a snapshot, oldest first
+    :param log_folder: The log folder of the config name (<log dir>/<name>)
+    """
+    run_folders = [log_folder / run["path"] for run in LogFolder.get_runs(log_folder)]
+    return [run_folder for run_folder in run_folders
+            if (run_folder / SNAPSHOT_DIRNAME / MANIFEST_FILENAME).is_file()]
+
+
+def diff(df_before: pd.DataFrame, df_after: pd.DataFrame) -> pd.DataFrame:
+    """
+    The candidates that appeared, went away, or whose DIFF_COLUMNS changed between two ranked tables
+    :param df_before: As from main.rank()
+    :param df_after: Likewise
+    :return: DIFF_KEY, a "change" ("new", "gone" or "changed"), and each of DIFF_COLUMNS before and after (NaN where
+             the candidate is missing). Ordered by change, then by key
+    """
+    # As text: the symbols of two runs are categories that differ
+    before = df_before[DIFF_KEY + DIFF_COLUMNS].astype({"symbol": str})
+    after = df_after[DIFF_KEY + DIFF_COLUMNS].astype({"symbol": str})
+    df_diff = pd.merge(before, after, on=DIFF_KEY, how="outer", suffixes=("_before", "_after"), indicator=True)
+
+    changed = np.zeros(len(df_diff), dtype=bool)
+    for column in DIFF_COLUMNS:
+        changed |= (df_diff[f"{column}_before"] != df_diff[f"{column}_after"]).to_numpy()
+    df_diff = df_diff[changed]
+
+    change = df_diff.pop("_merge").map({"left_only": "gone", "right_only": "new", "both": "changed"})
+    df_diff.insert(0, "change", change.astype(str))
+    return df_diff.sort_values(["change"] + DIFF_KEY, ignore_index=True)
+
+
+def load(run_folder: pathlib.Path) -> Snapshot:
+    """
+    The snapshot of a run, with df_apr mapped
+    :param run_folder: The log folder of the run
+    """
+    start = time.perf_counter()
+    snapshot = Snapshot(run_folder / SNAPSHOT_DIRNAME)
+    n_rows = len(snapshot.df_apr)
+    logger.info("Loaded the snapshot of {} ({} rows) in {:.1f} ms", run_folder, n_rows,
+                (time.perf_counter() - start) * 1000)
+    return snapshot
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Print the results of a past run again, or compare two runs")
+    parser.add_argument("name", help="The config name (the folder under the log dir)")
+    parser.add_argument("--log-dir", type=pathlib.Path, default=definitions.LOG_DIR,
+                        help="The root of the logs")
+    parser.add_argument("--run",
+                        help="The run, as <date>/<time> under the config name (default: the latest with a snapshot)")
+    parser.add_argument("--diff", action="store_true",
+                        help="Compare the run with an earlier one instead")
+    parser.add_argument("--against",
+                        help="The earlier run, as --run (default: the one before --run with a snapshot)")
+    parser.add_argument("--format", choices=["table"] + output.RECORD_FORMATS, default="table",
+                        help="Print tables, or write records for other tools")
+    parser.add_argument("--output",
+                        help="File to write records to (default: stdout)")
+    args = parser.parse_args(argv)
+
+    log_folder = args.log_dir / args.name
+    runs = find_runs(log_folder)
+    run_folder = log_folder / args.run if args.run else runs[-1] if runs else None
+    if run_folder is None or run_folder not in runs:
+        sys.exit(f"No snapshot of {args.run or 'any run'} under {log_folder}")
+
+    snapshot = load(run_folder)
+    if not args.diff:
+        # Imported here, like in Snapshot.ranked()
+        from .main import render
+        render(snapshot.ranked(), snapshot.symbols, args.format,
+               None if args.output is None else pathlib.Path(args.output))
+        return
+
+    earlier = runs[:runs.index(run_folder)]
+    against_folder = log_folder / args.against if args.against else earlier[-1] if earlier else None
+    if against_folder is None or against_folder not in runs:
+        sys.exit(f"No snapshot of {args.against or 'a run before ' + str(run_folder)} under {log_folder}")
+    df_diff = diff(load(against_folder).ranked(), snapshot.ranked())
+    print(f"{against_folder.relative_to(log_folder)} -> {run_folder.relative_to(log_folder)}")
+    output.print_changes(df_diff)
+
+
+if "__main__" == __name__:
+    main(sys.argv[1:])
@@ -0,0 +1,258 @@
+"""
+A local stand-in for the Tradier market data API, for measuring throughput and retries without a key or a network.
+Serves recorded payloads (the cache of a past run) or synthetic ones, with injected latency, 429s and errors.
+
+    python -m coverme.standin [--port 8001] [--recorded logs/<name>/<date>/<time>/cache] [--latency-ms 50] ...
+
+Then point the app at it with "tradier: base_url: http://127.0.0.1:8001".
+"""
+import argparse
+import collections
+import datetime
+import http.server
+import json
+import math
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from . import synthetic
+from .cache import open_store
+
+
+class SyntheticMarket:
+    def __init__(self, expirations: int = 8, strikes: int = 40, seed: int = 0):
+        """
+        Made-up payloads for any symbol asked for. The same symbol (and seed) always gets the same payloads
+        :param expirations: Weekly expirations per symbol
+        :param strikes: Strikes per expiration (each with a call and a put)
+        """
+        self.expirations = expirations
+        self.strikes = strikes
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._symbols: Dict[str, Tuple[dict, dict, Dict[str, dict]]] = {}
+
+    def _symbol(self, symbol: str) -> Tuple[dict, dict, Dict[str, dict]]:
+        with self._lock:
+            if symbol not in self._symbols:
+                rng = random.Random(f"{self.seed}:{symbol}")
+                last = round(math.exp(rng.uniform(math.log(5), math.log(500))), 2)
+                dates = synthetic.expiration_dates(self.expirations)
+                self._symbols[symbol] = (
+                    synthetic.quote(symbol, last),
+                    {"expirations": {"date": dates}},
+                    {date: synthetic.option_chain(symbol, last, date, self.strikes, rng) for date in dates},
+                )
+            return self._symbols[symbol]
+
+    def quote(self, symbol: str) -> Optional[dict]:
+        return self._symbol(symbol)[0]
+
+    def expirations_of(self, symbol: str) -> dict:
+        return self._symbol(symbol)[1]
+
+    def chain(self, symbol: str, expiration: str) -> dict:
+        return self._symbol(symbol)[2].get(expiration, {"options": None})
+
+
+class RecordedMarket:
+    def __init__(self, cache_folder):
+        """
+        The payloads a past run fetched, from its cache. Anything it didn't fetch is unknown
+        :param cache_folder: The "cache" folder of the run
+        """
+        self.store = open_store(cache_folder)
+
+    def _read(self, name: str, key: str) -> Optional[dict]:
+        return json.loads(self.store.read(name, key)) if self.store.exists(name, key) else None
+
+    def quote(self, symbol: str) -> Optional[dict]:
+        response = self._read("quotes", f"{(symbol,)}")
+        return None if response is None else (response.get('quotes') or {}).get('quote')
+
+    def expirations_of(self, symbol: str) -> dict:
+        return self._read("expiration", f"{(symbol,)}") or {"expirations": None}
+
+    def chain(self, symbol: str, expiration: str) -> dict:
+        return self._read("optionchains", f"{(symbol, expiration)}") or {"options": None}
+
+
+class Faults:
+    def __init__(self, latency_ms: float = 0.0, latency_sigma: float = 0.0, rate_limit: float = 0.0,
+                 error_rate: float = 0.0, seed: int = 0):
+        """
+        What goes wrong, and how slowly. Reproducible for a given seed and order of requests
+        :param latency_ms: Median latency of a response
+        :param latency_sigma: Spread of the latency (sigma of a log-normal). 0 for always the median
+        :param rate_limit: Requests per second allowed (with a burst of one second's worth). Beyond it, 429. 0 for
+                           no limit
+        :param error_rate: Share of requests answered with a 500 or 503
+        """
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = rate_limit
+        self._refilled_at = time.monotonic()
+
+    def delay(self) -> float:
+        """
+        Seconds to wait before responding
+        """
+        if self.latency_ms <= 0:
+            return 0.0
+        with self._lock:
+            return self._rng.lognormvariate(math.log(self.latency_ms), self.latency_sigma) / 1000
+
+    def failure(self) -> Optional[Tuple[int, dict]]:
+        """
+        The status and headers to fail the request with, None to serve it
+        """
+        with self._lock:
+            if self.rate_limit > 0:
+                now = time.monotonic()
+                self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled_at) * self.rate_limit)
+                self._refilled_at = now
+                if self._tokens < 1:
+                    retry_after = math.ceil((1 - self._tokens) / self.rate_limit)
+                    return 429, {"Retry-After": str(retry_after)}
+                self._tokens -= 1
+            if self.error_rate > 0 and self._rng.random() < self.error_rate:
+                return self._rng.choice([500, 503]), {}
+        return None
+
+
+def quotes_response(market, symbols: List[str]) -> dict:
+    """
+    Shaped like Tradier: a bare object for one quote, a list for several, unknown symbols listed apart
+    """
+    quotes = []
+    unmatched = []
+    for symbol in symbols:
+        quote = market.quote(symbol)
+        if quote is None:
+            unmatched.append({"symbol": symbol})
+        else:
+            quotes.append(quote)
+    response = {}
+    if quotes:
+        response["quote"] = quotes[0] if len(quotes) == 1 else quotes
+    if unmatched:
+        response["unmatched_symbols"] = unmatched[0] if len(unmatched) == 1 else unmatched
+    return {"quotes": response}
+
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], market, faults: Faults = None):
+        """
+        :param address: (host, port). Port 0 picks a free one
+        :param market: SyntheticMarket or RecordedMarket
+        :param faults: None for a perfect server
+        """
+        super().__init__(address, _Handler)
+        self.market = market
+        self.faults = Faults() if faults is None else faults
+        # Responses sent, by path then status
+        self.counts = collections.defaultdict(collections.Counter)
+        self._counts_lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, path: str, status: int):
+        with self._counts_lock:
+            self.counts[path][status] += 1
+
+    def start(self) -> threading.Thread:
+        """
+        Serve on a background thread, until shutdown()
+        """
+        thread = threading.Thread(target=self.serve_forever, name="standin", daemon=True)
+        thread.start()
+        return thread
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    # Keep connections alive, as the real API does
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+        market = self.server.market
+
+        time.sleep(self.server.faults.delay())
+        failure = self.server.faults.failure()
+        if failure is not None:
+            status, headers = failure
+            self._send(url.path, status, {"fault": status}, headers)
+        elif url.path == "/v1/markets/quotes":
+            symbols = [symbol for symbol in params.get("symbols", "").split(",") if symbol]
+            self._send(url.path, 200, quotes_response(market, symbols))
+        elif url.path == "/v1/markets/options/expirations":
+            self._send(url.path, 200, market.expirations_of(params.get("symbol", "")))
+        elif url.path == "/v1/markets/options/chains":
+            self._send(url.path, 200, market.chain(params.get("symbol", ""), params.get("expiration", "")))
+        else:
+            self._send(url.path, 404, {"fault": "unknown endpoint"})
+
+    def _send(self, path: str, status: int, payload: dict, headers: dict = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(path, status)
+
+    def log_message(self, format, *args):
+        # Way too chatty at the request rates this is meant for
+        pass
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Local stand-in for the Tradier market data API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--recorded", help="Serve the cache folder of a past run instead of synthetic data")
+    parser.add_argument("--expirations", type=int, default=8, help="Synthetic expirations per symbol")
+    parser.add_argument("--strikes", type=int, default=40, help="Synthetic strikes per expiration")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Median latency")
+    parser.add_argument("--latency-sigma", type=float, default=0.0, help="Spread of the (log-normal) latency")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="Requests per second before 429s")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with 5xx")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    market = RecordedMarket(args.recorded) if args.recorded else \
+        SyntheticMarket(args.expirations, args.strikes, args.seed)
+    faults = Faults(args.latency_ms, args.latency_sigma, args.rate_limit, args.error_rate, args.seed)
+    server = StandInServer((args.host, args.port), market, faults)
+    logger.info("Serving {} on {}", "recorded data" if args.recorded else "synthetic data", server.base_url)
+    start = datetime.datetime.now()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info("Served for {}: {}", datetime.datetime.now() - start,
+                    {path: dict(statuses) for path, statuses in server.counts.items()})
+
+
+if "__main__" == __name__:
+    main(sys.argv[1:])
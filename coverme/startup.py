@@ -0,0 +1,112 @@
+"""
+What cover.me spends starting up: the import time of every module, cold, in a fresh interpreter. Doubles as a check
+for scripts and CI, failing (exit status 1) past a time budget or when a cache-only run loads the network stack.
+
+    python -m coverme.startup [--top 15] [--budget-ms 700]
+    python -m coverme.startup [--budget-ms 1000] -- -c config.yml --cache
+
+The first profiles importing the app. The second profiles a whole run with the arguments after "--", including
+whatever it imports as it goes (it is a real run: it logs, and it fetches what isn't cached).
+"""
+import argparse
+import subprocess
+import sys
+from typing import Dict, List, Optional, Tuple
+
+from . import definitions
+
+# Budget for importing the app, in milliseconds. About 1.5x what it takes on a laptop
+IMPORT_BUDGET_MS = 700
+# Budget for the imports of a whole run, which also loads the config, the analysis and tabulate. About twice what a
+# run served from the cache takes on a laptop
+RUN_BUDGET_MS = 1000
+# Modules a run served from the cache (--cache) must never load
+NETWORK_MODULES = ["requests", "urllib3"]
+
+
+def profile(argv: Optional[List[str]] = None, repeat: int = 3) -> Dict[str, Tuple[int, int, int]]:
+    """
+    Import times, from python -X importtime. The fastest of a few runs is kept, the others being slowed down by
+    whatever else the machine is up to
+    :param argv: Arguments of a whole run of the app. None to only import it
+    :param repeat: Runs to take the fastest of
+    :return: (self, cumulative) microseconds and nesting depth of each module, in import order
+    """
+    command = [sys.executable, "-X", "importtime"]
+    command += ["-c", "import coverme.main"] if argv is None else ["-m", "coverme"] + argv
+
+    best = None
+    for _ in range(repeat):
+        # From the root of the repository, for "-m coverme" to find the package wherever this is run from
+        stderr = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+                                cwd=str(definitions.ROOT_DIR)).stderr
+        modules = {}
+        for line in stderr.splitlines():
+            # "import time: <self us> | <cumulative us> | <indent><module>". The header isn't numeric
+            fields = line[len("import time:"):].split("|")
+            if not line.startswith("import time:") or len(fields) != 3 or not fields[0].strip().isdigit():
+                continue
+            name = fields[2].rstrip()
+            depth = (len(name) - len(name.lstrip())) // 2
+            modules[name.strip()] = (int(fields[0]), int(fields[1]), depth)
+        if best is None or total_ms(modules) < total_ms(best):
+            best = modules
+    return best
+
+
+def total_ms(modules: Dict[str, Tuple[int, int, int]]) -> float:
+    return sum(self_us for self_us, _, _ in modules.values()) / 1000
+
+
+def check(modules: Dict[str, Tuple[int, int, int]], budget_ms: float, forbidden: List[str]) -> List[str]:
+    """
+    :return: What is wrong, if anything
+    """
+    problems = []
+    if total_ms(modules) > budget_ms:
+        problems.append(f"imports took {total_ms(modules):.0f} ms, over the budget of {budget_ms:.0f} ms")
+    problems += [f"{module} was imported (or a request was made)" for module in forbidden if module in modules]
+    return problems
+
+
+def report(modules: Dict[str, Tuple[int, int, int]], top: int) -> str:
+    """
+    The slowest top-level imports (what a deferred import would save), then the slowest modules on their own
+    """
+    lines = [f"{len(modules)} modules in {total_ms(modules):.1f} ms", "",
+             f"{'top-level import':<40}{'cumulative ms':>14}"]
+    roots = sorted(((name, cumulative) for name, (_, cumulative, depth) in modules.items() if depth == 0),
+                   key=lambda item: -item[1])
+    lines += [f"{name:<40}{cumulative / 1000:>14.1f}" for name, cumulative in roots[:top]]
+    lines += ["", f"{'module':<40}{'self ms':>14}"]
+    slowest = sorted(modules.items(), key=lambda item: -item[1][0])
+    lines += [f"{name:<40}{self_us / 1000:>14.1f}" for name, (self_us, _, _) in slowest[:top]]
+    return "\n".join(lines)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Profile the import time of cover.me, and check it")
+    parser.add_argument("--top", type=int, default=15, help="Modules to list")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs to take the fastest of")
+    parser.add_argument("--budget-ms", type=float,
+                        help=f"Fail past this many milliseconds of imports (default: {IMPORT_BUDGET_MS} when only "
+                             f"importing, {RUN_BUDGET_MS} for a run)")
+    parser.add_argument("run", nargs="*", help="Arguments of a whole run to profile (after --)")
+    args = parser.parse_args(argv)
+
+    run = args.run or None
+    modules = profile(run, args.repeat)
+    print(report(modules, args.top))
+
+    budget_ms = args.budget_ms if args.budget_ms is not None else IMPORT_BUDGET_MS if run is None else RUN_BUDGET_MS
+    # Importing the app doesn't need the network stack either: it is loaded when the first request is made
+    forbidden = NETWORK_MODULES if run is None or "--cache" in run else []
+    problems = check(modules, budget_ms, forbidden)
+    for problem in problems:
+        print(f"FAILED: {problem}")
+    if problems:
+        sys.exit(1)
+
+
+if "__main__" == __name__:
+    main(sys.argv[1:])
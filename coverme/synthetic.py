@@ -0,0 +1,105 @@
+"""
+Synthetic Tradier-shaped payloads (quotes, expirations and option chains) at any scale, for benchmarks and offline
+testing. Deterministic for a given seed.
+"""
+import datetime
+import math
+import random
+from typing import Dict, List, Tuple
+
+
+def symbol_names(count: int) -> List[str]:
+    """
+    Distinct ticker-looking symbols: A, B, ..., Z, AA, AB, ...
+    """
+    names = []
+    for i in range(count):
+        name = ""
+        i += 1
+        while i:
+            i, letter = divmod(i - 1, 26)
+            name = chr(ord('A') + letter) + name
+        names.append(name)
+    return names
+
+
+def expiration_dates(count: int, today: datetime.date = None) -> List[str]:
+    """
+    Weekly expirations: the next count Fridays
+    """
+    today = datetime.date.today() if today is None else today
+    friday = today + datetime.timedelta(days=(4 - today.weekday()) % 7 or 7)
+    return [str(friday + datetime.timedelta(weeks=i)) for i in range(count)]
+
+
+def quote(symbol: str, last: float) -> dict:
+    return {
+        "symbol": symbol, "description": f"{symbol} Inc", "exch": "Q", "type": "stock",
+        "last": last, "change": 0.0, "volume": 1000000, "open": last, "high": last, "low": last, "close": None,
+        "bid": round(last - 0.01, 2), "ask": round(last + 0.01, 2), "change_percentage": 0.0,
+        "average_volume": 1000000, "last_volume": 100, "trade_date": 0, "prevclose": last,
+        "week_52_high": round(last * 1.3, 2), "week_52_low": round(last * 0.7, 2), "bidsize": 1, "bidexch": "Q",
+        "bid_date": 0, "asksize": 1, "askexch": "Q", "ask_date": 0, "root_symbols": symbol,
+    }
+
+
+def _contract(symbol: str, expiration: str, option_type: str, strike: float, bid: float, ask: float) -> dict:
+    code = f"{symbol}{expiration[2:].replace('-', '')}{option_type[0].upper()}{int(strike * 1000):08d}"
+    return {
+        "symbol": code, "description": f"{symbol} {expiration} {strike} {option_type}", "exch": "Z",
+        "type": "option", "last": bid, "change": None, "volume": 0, "open": None, "high": None, "low": None,
+        "close": None, "bid": bid, "ask": ask, "underlying": symbol, "strike": strike, "change_percentage": None,
+        "average_volume": 0, "last_volume": 0, "trade_date": 0, "prevclose": None, "week_52_high": 0.0,
+        "week_52_low": 0.0, "bidsize": 10, "bidexch": "Q", "bid_date": 0, "asksize": 10, "askexch": "Q",
+        "ask_date": 0, "open_interest": 100, "contract_size": 100, "expiration_date": expiration,
+        "expiration_type": "weeklys", "option_type": option_type, "root_symbol": symbol,
+    }
+
+
+def option_chain(symbol: str, last: float, expiration: str, strikes: int, rng: random.Random,
+                 today: datetime.date = None) -> dict:
+    """
+    Calls and puts at strikes spread around the last price. Premiums are intrinsic value plus a time value that
+    grows with time to expiry and shrinks away from the money
+    """
+    today = datetime.date.today() if today is None else today
+    years = max((datetime.date.fromisoformat(expiration) - today).days, 1) / 365
+    volatility = rng.uniform(0.2, 0.8)
+    step = 10 ** math.floor(math.log10(last)) / 20
+    first = round(last / step) * step - step * (strikes // 2)
+
+    contracts = []
+    for i in range(strikes):
+        strike = round(max(first + i * step, step), 2)
+        moneyness = abs(math.log(strike / last)) / (volatility * math.sqrt(years))
+        time_value = 0.4 * last * volatility * math.sqrt(years) * math.exp(-0.5 * moneyness ** 2)
+        for option_type, intrinsic in (("call", max(last - strike, 0.0)), ("put", max(strike - last, 0.0))):
+            value = intrinsic + time_value
+            bid = round(max(value * rng.uniform(0.95, 1.0) - 0.01, 0.0), 2)
+            ask = round(value * rng.uniform(1.0, 1.05) + 0.01, 2)
+            contracts.append(_contract(symbol, expiration, option_type, strike, bid, ask))
+
+    return {"options": {"option": contracts}}
+
+
+def universe(symbols: int, expirations: int, strikes: int, seed: int = 0,
+             today: datetime.date = None) -> Tuple[Dict[str, dict], Dict[str, dict], Dict[str, Dict[str, dict]]]:
+    """
+    A whole universe, shaped like what main.fetch returns
+    :param symbols: The number of symbols
+    :param expirations: Weekly expirations per symbol
+    :param strikes: Strikes per expiration (each with a call and a put)
+    :param seed: Seed of the random prices
+    :return: quotes, expirations and option chains, by symbol
+    """
+    rng = random.Random(seed)
+    dates = expiration_dates(expirations, today)
+    quotes, all_expirations, option_chains = {}, {}, {}
+    for symbol in symbol_names(symbols):
+        last = round(math.exp(rng.uniform(math.log(5), math.log(500))), 2)
+        quotes[symbol] = {"quotes": {"quote": quote(symbol, last)}}
+        all_expirations[symbol] = {"expirations": {"date": list(dates)}}
+        option_chains[symbol] = {
+            expiration: option_chain(symbol, last, expiration, strikes, rng, today) for expiration in dates
+        }
+    return quotes, all_expirations, option_chains
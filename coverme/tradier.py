@@ -1,33 +1,142 @@
-import requests
-from requests.adapters import HTTPAdapter
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, List, Union
 
+from .metrics import metrics
 
-def open_session(api_key: str) -> requests.Session:
+if TYPE_CHECKING:
+    # Only imported once a session is opened: runs served from the cache never need the network stack
+    import requests
+
+# Responses worth retrying: rate limited or a server-side hiccup
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def open_session(api_key: str, pool_size: int = 1) -> "requests.Session":
     """
     See https://developer.tradier.com/getting_started for an api key
     :param api_key: The Tradier-provided API key
-    :return: The session
+    :param pool_size: The number of connections to keep alive. Should match the number of concurrent requests
+    :return: The session. It doesn't retry: TradierApi does, through its rate limiter
     """
+    import requests
+    from requests.adapters import HTTPAdapter
+
     session = requests.Session()
-    session.mount('https://', HTTPAdapter(max_retries=1))
+    # http:// too, for a local stand-in (see standin)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
     session.headers.update({'Authorization': 'Bearer ' + api_key, 'Accept': 'application/json'})
 
     return session
 
+
+def expiration_dates(expirations: dict) -> List[str]:
+    """
+    The dates from an options_expirations response. Tradier sends null when there are none and a bare string when
+    there is only one
+    :param expirations: Parsed response of TradierApi.options_expirations
+    :return: The dates, as ISO strings
+    """
+    dates = (expirations.get('expirations') or {}).get('date') or []
+    return [dates] if isinstance(dates, str) else list(dates)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_second: float):
+        """
+        Spaces out calls so no more than requests_per_second are started. Thread safe.
+        :param requests_per_second: The budget. 0 (or less) disables limiting
+        """
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_time = time.monotonic()
+
+    def wait(self):
+        """
+        Block until the caller is allowed to make its request
+        """
+        if not self.interval:
+            return
+
+        # Reserve the next slot while holding the lock, but sleep outside of it
+        with self._lock:
+            slot = max(self._next_time, time.monotonic())
+            self._next_time = slot + self.interval
+
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
 class TradierApi:
-    def __init__(self, session: requests.Session, base_url: str):
+    def __init__(self, session: Union["requests.Session", Callable[[], "requests.Session"]], base_url: str,
+                 rate_limiter: RateLimiter = None, quote_batch_chars: int = 1500, max_retries: int = 1,
+                 backoff_factor: float = 0.0):
         """
         See API docs for info.
         https://documentation.tradier.com/brokerage-api/overview/market-data
+        :param session: The session, or a function opening it. It is then opened by the first call, so a run that
+                        makes none doesn't pay for importing requests
+        :param quote_batch_chars: Longest comma-separated symbol list sent in one quotes request (keeps the URL short)
+        :param max_retries: Retries on connection errors and on 429/5xx responses
+        :param backoff_factor: Exponential backoff between retries, in seconds. Retry-After is honored instead when
+                               the server sends it
         """
-        self.session = session
+        self._session = session
+        self._session_lock = threading.Lock()
         self.base_url = base_url
+        self.rate_limiter = rate_limiter
+        self.quote_batch_chars = quote_batch_chars
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+    @property
+    def session(self) -> "requests.Session":
+        # Calls come from several threads at once
+        with self._session_lock:
+            if callable(self._session):
+                self._session = self._session()
+        return self._session
 
     def quote(self, symbol: str):
         url = self.base_url + f"/v1/markets/quotes"
         params = {"symbols": symbol}
         return self._get(url, params)
 
+    def quotes(self, symbols: List[str]) -> List[dict]:
+        """
+        Quotes for many symbols in as few requests as quote_batch_chars allows
+        :return: One response per symbol, shaped like the response of quote()
+        """
+        url = self.base_url + f"/v1/markets/quotes"
+        by_symbol = {}
+        for batch in self._batches(symbols):
+            response = self._get(url, {"symbols": ",".join(batch)})
+            # A single quote comes back as a bare object rather than a list
+            quotes = (response.get('quotes') or {}).get('quote') or []
+            for quote in [quotes] if isinstance(quotes, dict) else quotes:
+                by_symbol[quote['symbol'].upper()] = {'quotes': {'quote': quote}}
+
+        return [by_symbol.get(symbol.upper(), {'quotes': {'unmatched_symbols': {'symbol': symbol}}})
+                for symbol in symbols]
+
+    def _batches(self, symbols: List[str]) -> List[List[str]]:
+        """
+        Split symbols so each comma-separated batch fits in quote_batch_chars
+        """
+        batches = []
+        length = 0
+        for symbol in symbols:
+            if batches and length + 1 + len(symbol) <= self.quote_batch_chars:
+                batches[-1].append(symbol)
+                length += 1 + len(symbol)
+            else:
+                batches.append([symbol])
+                length = len(symbol)
+        return batches
+
     def options_expirations(self, symbol: str):
         url = self.base_url + f"/v1/markets/options/expirations"
         params = {"symbol": symbol}
@@ -38,16 +147,44 @@ class TradierApi:
         params = {"symbol": symbol, "expiration": expiration}
         return self._get(url, params)
 
+    def _backoff(self, attempt: int, response) -> float:
+        """
+        Seconds to wait before retrying
+        :param attempt: The attempt that failed, from 0
+        :param response: Its response. None after a connection error
+        """
+        retry_after = None if response is None else response.headers.get("Retry-After")
+        if retry_after is not None and retry_after.strip().isdigit():
+            return float(retry_after)
+        return self.backoff_factor * 2 ** attempt
+
     def _get(self, url, params):
         """
-        Make the call to the server and parse the JSON. Throws on error
+        Make the call to the server and parse the JSON, retrying on connection errors and 429/5xx responses. Every
+        attempt waits for the rate limiter, retries included. Throws on error
         :return: Parsed JSON
         """
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            if self.rate_limiter is not None:
+                self.rate_limiter.wait()
 
-        # Make API call for GET request
-        response = self.session.get(url, params=params)
+            # Make API call for GET request
+            start = time.perf_counter()
+            response = None
+            try:
+                response = self.session.get(url, params=params)
+            except IOError:
+                # Every error of requests is an IOError: connection refused or reset, timeouts
+                if last_attempt:
+                    raise
+            finally:
+                metrics.record_request(url[len(self.base_url):], time.perf_counter() - start,
+                                       None if response is None else response.status_code,
+                                       0 if response is None else len(response.content))
 
-        if response is not None and response.status_code == 200:
-            return response.json()
-        else:
-            raise IOError(f"Bad response: {response.text}")
+            if response is not None and response.status_code == 200:
+                return response.json()
+            if response is not None and (response.status_code not in RETRY_STATUSES or last_attempt):
+                raise IOError(f"Bad response: {response.text}")
+            time.sleep(self._backoff(attempt, response))
@@ -0,0 +1,152 @@
+"""
+Black-Scholes implied volatility, and the assignment risk that follows from it, for whole columns of calls at once.
+
+European exercise and no dividends. Good enough to compare calls with each other: an American call on a stock that
+pays no dividend is worth the same, and a dividend mostly shifts every call on the stock alike.
+"""
+from typing import Tuple
+
+import numpy as np
+
+# Implied volatilities are looked for within these (annualized)
+MIN_VOLATILITY = 1e-4
+MAX_VOLATILITY = 5.0
+# Solved when the model price is within this share of the time value (the price over the intrinsic value)...
+PRICE_TOLERANCE = 1e-8
+# ...or within this, per share: far less than any price quoted
+PRICE_FLOOR = 1e-10
+# ...or the volatility is pinned down to within this
+VOLATILITY_TOLERANCE = 1e-8
+# Iterations at most. A Newton step that would leave the bracket or move less than half as far as the step before is
+# replaced by bisection, so this is more than enough to get from MAX_VOLATILITY to VOLATILITY_TOLERANCE
+MAX_ITERATIONS = 64
+
+_SQRT_2 = np.sqrt(2.0)
+_SQRT_2PI = np.sqrt(2.0 * np.pi)
+
+
+def _erfc(x: np.ndarray) -> np.ndarray:
+    """
+    Complementary error function, with a fractional error under 1.2e-7 everywhere (Numerical Recipes' erfcc)
+    """
+    z = np.abs(x)
+    t = 1.0 / (1.0 + 0.5 * z)
+    poly = -1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (0.09678418 + t * (
+        -0.18628806 + t * (0.27886807 + t * (-1.13520398 + t * (1.48851587 + t * (
+            -0.82215223 + t * 0.17087277))))))))
+    result = t * np.exp(-z * z + poly)
+    return np.where(x >= 0, result, 2.0 - result)
+
+
+def norm_cdf(x: np.ndarray) -> np.ndarray:
+    """
+    Standard normal cumulative distribution. Accurate in the tails too, where 1 - cdf would round to 0
+    """
+    return 0.5 * _erfc(-x / _SQRT_2)
+
+
+def norm_pdf(x: np.ndarray) -> np.ndarray:
+    return np.exp(-0.5 * x * x) / _SQRT_2PI
+
+
+def _d1_d2(stock: np.ndarray, strike: np.ndarray, years: np.ndarray, rate: float,
+           volatility: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    spread = volatility * np.sqrt(years)
+    d1 = (np.log(stock / strike) + (rate + 0.5 * volatility * volatility) * years) / spread
+    return d1, d1 - spread
+
+
+def call_price(stock: np.ndarray, strike: np.ndarray, years: np.ndarray, rate: float,
+               volatility: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: The Black-Scholes price of each call, and its vega (the price's derivative by the volatility)
+    """
+    d1, d2 = _d1_d2(stock, strike, years, rate, volatility)
+    price = stock * norm_cdf(d1) - strike * np.exp(-rate * years) * norm_cdf(d2)
+    return price, stock * norm_pdf(d1) * np.sqrt(years)
+
+
+def implied_volatility(price: np.ndarray, stock: np.ndarray, strike: np.ndarray, years: np.ndarray,
+                       rate: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The volatility at which each call is worth price. Newton's method, kept within a bracket that every iteration
+    narrows, falling back on bisection when a step would leave it or is slow to converge (vega vanishes far from the
+    money)
+    :param price: Market price of each call, per share
+    :param stock: Price of the underlying
+    :param strike: Strike price
+    :param years: Time to expiry
+    :param rate: Risk-free rate, annual and continuously compounded
+    :return: The implied volatility (NaN where there is none), and the mask of the rows where it was found. There is
+             none for a price at or under the call's intrinsic value (often a stale or missing bid deep in the
+             money), at or over the stock price, or outside [MIN_VOLATILITY, MAX_VOLATILITY]
+    """
+    price, stock, strike, years = np.broadcast_arrays(*(np.asarray(x, dtype=np.float64)
+                                                        for x in (price, stock, strike, years)))
+    result = np.full(price.shape, np.nan)
+    converged = np.zeros(price.shape, dtype=bool)
+
+    # No-arbitrage bounds of a call. NaN compares False, so missing inputs are left out here
+    with np.errstate(invalid='ignore'):
+        intrinsic = np.maximum(stock - strike * np.exp(-rate * years), 0.0)
+        rows = np.flatnonzero((price > intrinsic) & (price < stock) & (strike > 0) & (years > 0))
+
+    # And a solution within the bounds: the price is between the prices at either bound
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rows = rows[(call_price(stock[rows], strike[rows], years[rows], rate, MIN_VOLATILITY)[0] <= price[rows]) &
+                    (price[rows] <= call_price(stock[rows], strike[rows], years[rows], rate, MAX_VOLATILITY)[0])]
+
+    # Only the rows still being solved are carried along, as compact copies
+    price, stock, strike, years = price[rows], stock[rows], strike[rows], years[rows]
+    # Far from the money, the time value is all the volatility moves. An absolute tolerance would take any
+    # volatility for a call worth next to nothing
+    tolerance = np.maximum(PRICE_TOLERANCE * (price - intrinsic[rows]), PRICE_FLOOR)
+    low = np.full(len(rows), MIN_VOLATILITY)
+    high = np.full(len(rows), MAX_VOLATILITY)
+    previous_move = high - low
+    # Manaster-Koehler: where vega peaks. Newton's method converges monotonically from there
+    volatility = np.clip(np.sqrt(2 * np.abs(np.log(stock / strike) + rate * years) / years),
+                         MIN_VOLATILITY, MAX_VOLATILITY)
+
+    for _ in range(MAX_ITERATIONS):
+        if not len(rows):
+            break
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            model, vega = call_price(stock, strike, years, rate, volatility)
+            error = model - price
+            # The price rises with the volatility, so the root is below a volatility that prices too high
+            too_high = error > 0
+            low = np.where(too_high, low, volatility)
+            high = np.where(too_high, volatility, high)
+
+        done = (np.abs(error) < tolerance) | (high - low < VOLATILITY_TOLERANCE)
+        result[rows[done]] = volatility[done]
+        converged[rows[done]] = True
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            # On the log of the price, which is close to linear in the volatility even far out of the money
+            newton = (np.log(model) - np.log(price)) * model / vega
+            use_newton = ((volatility - newton > low) & (volatility - newton < high) &
+                          (np.abs(newton) <= 0.5 * previous_move))
+            move = np.where(use_newton, newton, volatility - 0.5 * (low + high))
+        volatility = volatility - move
+        previous_move = np.abs(move)
+
+        if done.any():
+            left = ~done
+            rows, price, stock, strike, years, tolerance, low, high, previous_move, volatility = (
+                values[left] for values in (rows, price, stock, strike, years, tolerance, low, high, previous_move,
+                                            volatility))
+
+    return result, converged
+
+
+def assignment_risk(stock: np.ndarray, strike: np.ndarray, years: np.ndarray, rate: float,
+                    volatility: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: The delta of each call, and the (risk-neutral) probability it expires in the money, i.e. that the
+             stock is called away. NaN where the volatility is
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1, d2 = _d1_d2(stock, strike, years, rate, volatility)
+    return norm_cdf(d1), norm_cdf(d2)
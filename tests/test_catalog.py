@@ -0,0 +1,32 @@
+"""
+Runs of a config recorded by processes going at the same time
+"""
+import datetime
+import multiprocessing
+
+from coverme.catalog import Catalog
+
+RUNS_PER_PROCESS = 20
+
+
+def add_runs(root, process):
+    catalog = Catalog(root)
+    for i in range(RUNS_PER_PROCESS):
+        start_time = datetime.datetime(2026, 10, 16, 9, process, i)
+        folder = root / str(start_time.date()) / str(start_time).replace(':', "-").replace(" ", "_")
+        folder.mkdir(parents=True)
+        catalog.add(folder, start_time)
+        catalog.finish(folder, "ok")
+
+
+def test_concurrent_processes(tmp_path):
+    processes = [multiprocessing.Process(target=add_runs, args=(tmp_path, process)) for process in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    # None lost to another process writing over the catalog
+    runs = Catalog(tmp_path).runs()
+    assert len(runs) == 4 * RUNS_PER_PROCESS
+    assert {run["status"] for run in runs} == {"ok"}
@@ -0,0 +1,133 @@
+"""
+The dominance rules against the row-by-row loop they replaced, which is kept here as the reference
+"""
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from coverme import dominance, synthetic
+from coverme.analysis import Analysis
+
+RULES = ["worse_apr_strike", "worse_premium_expiry", "worse_strike_expiry"]
+
+
+def reference(df_apr: pd.DataFrame) -> dict:
+    """
+    The original implementation of Analysis.df_apr_objective_omit, on a copy
+    :return: The position of the beating row per row (-1 if none), by rule
+    """
+    df_output = df_apr.reset_index(drop=True)
+
+    # Add some rules for good deals that are objectively beaten
+    df_output["worse_apr_strike"] = None
+    df_output["worse_premium_expiry"] = None
+    df_output["worse_strike_expiry"] = None
+
+    for rowi, row in df_output.iterrows():
+        # For a fixed expiry date, an option with both a greater APR and and greater strike price is objectively better
+        df_output.loc[
+            (row['expiration_date'] == df_output['expiration_date']) &
+            (row['net_premium_adj_apr'] >= df_output["net_premium_adj_apr"]) &
+            (row['strike'] >= df_output["strike"]) &
+            # Needs to be the same symbol
+            (row['symbol'] == df_output['symbol']) &
+            # Don't check itself
+            (rowi != df_output.index),
+            'worse_apr_strike'] = rowi
+
+        # For a fixed strike price, an option with both a great premium / contract and a sooner expiry date is
+        # objectively better
+        df_output.loc[
+            (row['expiration_date'] <= df_output['expiration_date']) &
+            (row['net_premium'] >= df_output["net_premium"]) &
+            (row['strike'] == df_output["strike"]) &
+            # Needs to be the same symbol
+            (row['symbol'] == df_output['symbol']) &
+            # Don't check itself
+            (rowi != df_output.index),
+            'worse_premium_expiry'] = rowi
+
+        # For a fixed APR (within 1%), an option with a sooner expiry date and a >= strike price is possibly better.
+        # ... In further thought it's more of a judgement call. Longer expiry to take advantage of a higher APR for
+        # longer
+        df_output.loc[
+            (row['expiration_date'] <= df_output['expiration_date']) &
+            ((row['net_premium_adj_apr'] - df_output["net_premium_adj_apr"]).abs() < 1) &
+            (row['strike'] >= df_output["strike"]) &
+            # Needs to be the same symbol
+            (row['symbol'] == df_output['symbol']) &
+            # Don't check itself
+            (rowi != df_output.index),
+            'worse_strike_expiry'] = rowi
+
+    return {rule: df_output[rule].fillna(-1).to_numpy(dtype=np.int64) for rule in RULES}
+
+
+def dominators(df_apr: pd.DataFrame) -> dict:
+    return dominance.dominators(pd.factorize(df_apr["symbol"])[0],
+                                dominance.to_days(df_apr["expiration_date"]),
+                                df_apr["net_premium_adj_apr"].to_numpy(dtype=float),
+                                df_apr["net_premium"].to_numpy(dtype=float),
+                                df_apr["strike"].to_numpy(dtype=float))
+
+
+def tied(n_rows: int, symbols: int, expirations: int, seed: int) -> pd.DataFrame:
+    """
+    Columns drawn from a few values, so rows tie on every criterion, with some NaNs. APRs are half a point apart, on
+    either side of the 1 point tolerance
+    """
+    rng = np.random.RandomState(seed)
+    dates = pd.date_range("2026-10-23", periods=expirations, freq="7D")
+    df = pd.DataFrame({
+        "symbol": rng.choice([f"S{i}" for i in range(symbols)], n_rows),
+        "expiration_date": dates[rng.randint(expirations, size=n_rows)],
+        "net_premium_adj_apr": rng.randint(0, 12, n_rows) * 0.5,
+        "net_premium": rng.randint(0, 6, n_rows) * 0.25,
+        "strike": rng.randint(0, 8, n_rows) * 2.5 + 50,
+    })
+    for column in ["net_premium_adj_apr", "net_premium"]:
+        df.loc[rng.rand(n_rows) < 0.05, column] = np.nan
+    return df
+
+
+def assert_same(df_apr: pd.DataFrame):
+    expected = reference(df_apr)
+    actual = dominators(df_apr)
+    for rule in RULES:
+        np.testing.assert_array_equal(actual[rule], expected[rule], err_msg=rule)
+
+
+# Groups far larger than _SMALL_GROUP, so _last_dominator's window sweep runs, and small ones compared at once
+@pytest.mark.parametrize("n_rows, symbols, expirations, seed", [
+    (40, 2, 3, 0),
+    (200, 1, 2, 1),
+    (300, 2, 2, 2),
+    (250, 3, 4, 3),
+])
+def test_ties_and_nans(n_rows, symbols, expirations, seed):
+    assert_same(tied(n_rows, symbols, expirations, seed))
+
+
+@pytest.mark.parametrize("small_group", [0, 1 << 20])
+def test_sweep_and_small_groups_agree(monkeypatch, small_group):
+    # Every group through one path only. A narrow chunk exercises the key windows of the sweep
+    monkeypatch.setattr(dominance, "_SMALL_GROUP", small_group)
+    monkeypatch.setattr(dominance, "_TARGET_CHUNK", 3)
+    assert_same(tied(150, 2, 3, 4))
+
+
+def test_synthetic_universe():
+    analysis = Analysis(*synthetic.universe(2, 3, 80, seed=5, today=datetime.date(2026, 10, 16)),
+                        today=datetime.date(2026, 10, 16))
+    analysis.set_time_horizon(datetime.timedelta(weeks=4))
+    df_apr = analysis.df_apr
+    # Per symbol and expiry too, beyond _SMALL_GROUP
+    assert df_apr.groupby(["symbol", "expiration_date"]).size().max() > dominance._SMALL_GROUP
+
+    expected = reference(df_apr)
+    df_omit = analysis.df_apr_objective_omit
+    for rule in RULES:
+        np.testing.assert_array_equal(df_omit[rule].fillna(-1).to_numpy(dtype=np.int64), expected[rule],
+                                      err_msg=rule)
@@ -0,0 +1,53 @@
+"""
+Finding the latest run of a config, when the catalog is out of date
+"""
+import datetime
+import shutil
+
+import pytest
+
+from coverme.catalog import Catalog
+from coverme.log_folder import LogFolder
+
+
+@pytest.fixture
+def log_folder(tmp_path, monkeypatch):
+    """
+    The log folder of a config with two runs recorded in its catalog, oldest first
+    """
+    monkeypatch.setattr(LogFolder, "latest_log_folder", None)
+    monkeypatch.setattr(LogFolder, "latest_log_folder_checked", False)
+    catalog = Catalog(tmp_path)
+    for start_time in [datetime.datetime(2026, 10, 15, 9, 30), datetime.datetime(2026, 10, 16, 9, 30)]:
+        folder = tmp_path / str(start_time.date()) / str(start_time).replace(':', "-").replace(" ", "_")
+        folder.mkdir(parents=True)
+        catalog.add(folder, start_time)
+    return tmp_path
+
+
+def test_latest_from_catalog(log_folder):
+    assert LogFolder.get_latest_log_folder(log_folder) == log_folder / "2026-10-16" / "2026-10-16_09-30-00"
+
+
+def test_latest_deleted_by_hand(log_folder):
+    shutil.rmtree(log_folder / "2026-10-16")
+
+    # The catalog sorts after the date folders, and must not be taken for one
+    assert LogFolder.get_latest_log_folder(log_folder) == log_folder / "2026-10-15" / "2026-10-15_09-30-00"
+    # Repaired for the next run
+    assert Catalog(log_folder).latest() == log_folder / "2026-10-15" / "2026-10-15_09-30-00"
+
+
+def test_every_run_deleted_by_hand(log_folder):
+    shutil.rmtree(log_folder / "2026-10-15")
+    shutil.rmtree(log_folder / "2026-10-16")
+
+    # What conguru.init expects when there is no previous run
+    with pytest.raises(FileNotFoundError):
+        LogFolder.get_latest_log_folder(log_folder)
+    assert Catalog(log_folder).latest() is None
+
+
+def test_date_folders_only(log_folder):
+    assert [folder.name for folder in LogFolder._get_date_folders(log_folder)] == ["2026-10-15", "2026-10-16"]
+    assert LogFolder.get_recent_datetime_folder(log_folder) == log_folder / "2026-10-16" / "2026-10-16_09-30-00"
@@ -0,0 +1,51 @@
+"""
+The screening rules, and the dominance rules they must not change
+"""
+import datetime
+
+from coverme import synthetic
+from coverme.analysis import Analysis
+from coverme.main import rank
+from coverme.screening import Screen
+
+TODAY = datetime.date(2026, 10, 16)
+
+
+def universe(contracts: dict):
+    """
+    One stock at $100, with a single call per expiration
+    :param contracts: (strike, bid) by expiration
+    """
+    quotes = {"S": {"quotes": {"quote": synthetic.quote("S", 100.0)}}}
+    expirations = {"S": {"expirations": {"date": list(contracts)}}}
+    option_chains = {"S": {expiration: {"options": {"option": [
+        synthetic._contract("S", expiration, "call", strike, bid, bid + 0.05)]}}
+        for expiration, (strike, bid) in contracts.items()}}
+    return quotes, expirations, option_chains
+
+
+def ranked(screen: Screen, contracts: dict):
+    analysis = Analysis(*universe(contracts), today=TODAY, screen=screen)
+    analysis.set_time_horizon(datetime.timedelta(days=30))
+    return rank(analysis, True, screen)
+
+
+def test_min_bid_after_dominance():
+    # The sooner call bids less than min_bid, yet dominates the later one by worse_strike_expiry: same strike, an APR
+    # within a point
+    contracts = {"2026-10-23": (105.0, 0.20), "2026-10-30": (105.0, 0.40)}
+
+    assert ranked(Screen(min_bid=0, min_apr=0), contracts)["bid"].tolist() == [0.20]
+    # Not in the table itself, but the later call is still beaten
+    screen = Screen(min_bid=0.30, min_apr=0)
+    assert ranked(screen, contracts).empty
+    assert screen.removed["dominated"] == 1
+    assert screen.removed["bid >= 0.3"] == 1
+
+
+def test_strike_below_stock_pushed_down():
+    screen = Screen(min_apr=0)
+    df_ranked = ranked(screen, {"2026-10-23": (95.0, 5.50), "2026-10-30": (105.0, 0.40)})
+
+    assert df_ranked["strike"].tolist() == [105.0]
+    assert screen.removed["strike > last_stock"] == 1
@@ -0,0 +1,44 @@
+"""
+Cold start of a run served from the cache (--cache), in a fresh interpreter
+"""
+import datetime
+import json
+
+from coverme import startup, synthetic
+from coverme.cache import open_store
+from coverme.catalog import Catalog
+
+NAME = "startup"
+
+
+def test_cache_run(tmp_path):
+    # A previous run whose cache holds everything the next one needs
+    today = datetime.date.today()
+    quotes, expirations, option_chains = synthetic.universe(3, 2, 20, today=today)
+    start_time = datetime.datetime.now() - datetime.timedelta(minutes=1)
+    previous = tmp_path / NAME / str(start_time.date()) / str(start_time).replace(':', "-").replace(" ", "_")
+    store = open_store(previous / "cache", "files")
+    for symbol in quotes:
+        store.write("quotes", f"{(symbol,)}", json.dumps(quotes[symbol]))
+        store.write("expiration", f"{(symbol,)}", json.dumps(expirations[symbol]))
+        for expiration, chain in option_chains[symbol].items():
+            store.write("optionchains", f"{(symbol, expiration)}", json.dumps(chain))
+    Catalog(tmp_path / NAME).add(previous, start_time)
+
+    config = tmp_path / "config.yml"
+    # Nothing listens there: a request would fail the run
+    config.write_text(f"name: {NAME}\n"
+                      f"symbols: [{', '.join(quotes)}]\n"
+                      f"horizon_days: 30\n"
+                      f"tradier:\n"
+                      f"  key: x\n"
+                      f"  base_url: http://127.0.0.1:9\n")
+
+    # Which modules are loaded doesn't vary between runs, unlike how long they take: one run will do
+    modules = startup.profile(["-c", str(config), "--cache", "--log-dir", str(tmp_path)], repeat=1)
+
+    # The run went all the way
+    assert Catalog(tmp_path / NAME).runs()[-1]["status"] == "ok"
+    assert "coverme.analysis" in modules
+    # The time budget is left to "python -m coverme.startup", on a machine known to be quiet
+    assert not set(startup.NETWORK_MODULES) & set(modules)
@@ -0,0 +1,70 @@
+"""
+Retries of the Tradier API, through the rate limiter
+"""
+import json
+
+import pytest
+
+from coverme.tradier import RateLimiter, TradierApi
+
+
+class Response:
+    def __init__(self, status_code: int, payload: dict = None, headers: dict = None):
+        self.status_code = status_code
+        self.text = json.dumps(payload or {})
+        self.content = self.text.encode()
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class Session:
+    """
+    Answers each request with the next of responses (an exception is raised instead)
+    """
+    def __init__(self, responses: list):
+        self.responses = list(responses)
+
+    def get(self, url, params=None):
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class CountingLimiter(RateLimiter):
+    def __init__(self):
+        super().__init__(0)
+        self.waits = 0
+
+    def wait(self):
+        self.waits += 1
+
+
+def test_retries_wait_for_the_limiter():
+    limiter = CountingLimiter()
+    session = Session([Response(429, headers={"Retry-After": "0"}), ConnectionError("reset"), Response(503),
+                       Response(200, {"ok": True})])
+    api = TradierApi(session, "http://tradier", limiter, max_retries=3)
+
+    assert api.option_chain("S0", "2026-10-23") == {"ok": True}
+    assert limiter.waits == 4
+
+
+def test_gives_up_after_max_retries():
+    limiter = CountingLimiter()
+    api = TradierApi(Session([Response(503)] * 3), "http://tradier", limiter, max_retries=2)
+
+    with pytest.raises(IOError):
+        api.option_chain("S0", "2026-10-23")
+    assert limiter.waits == 3
+
+
+def test_no_retry_on_client_errors():
+    limiter = CountingLimiter()
+    api = TradierApi(Session([Response(401), Response(200)]), "http://tradier", limiter, max_retries=3)
+
+    with pytest.raises(IOError):
+        api.option_chain("S0", "2026-10-23")
+    assert limiter.waits == 1